@@ -6,55 +6,35 @@ import numpy as np
 import PIL
 import wget
 from backend.ggldecode import *
+from backend.engines import page_layout
+from backend.layout import number_boxes
 from backend.solve import *
-import textwrap
 
 
 # if no parser is chosen:
 # util available - number highlighter
-def num_highlighter(img):
+def num_highlighter(img, engine=None):
     if isinstance(img, PIL.Image.Image):
         img = np.asarray(img)
     # img in numpy array format
-    outputtext, outputImag = google_api_decode(img)
-    # output image in numpy array format
-    return outputImag
+    # output (n, 4) array of (x0, y0, x1, y1) boxes in pixels of the image,
+    # drawn over the page by the UI
+    return number_boxes(page_layout(img, engine))
 
 
 # if parser chosen:
 # google api parser
 # util available - solver
-def gglapi_parse(img, enable_solver=False):
+def gglapi_parse(img, enable_solver=False, engine=None):
     if isinstance(img, PIL.Image.Image):
         img = np.asarray(img)
     # img in numpy array format
-    outputtext, outputImag = google_api_decode(img)
-    font = ImageFont.truetype("backend/arial.ttf", 40)
-    base = Image.open("backend/blank.png").convert("RGBA")
-    img = Image.new("RGB", base.size, (255, 255, 255))
-    I1 = ImageDraw.Draw(img)
-    if enable_solver:
-        counter = 0
-        for line in outputtext.splitlines():
-            if not solve_str(line):
-                for lin in textwrap.wrap(line, width=100):
-                    I1.text((100, 100 + counter), lin, font=font, fill=(255, 0, 0))
-                    counter += 40
-                #I1.text((100, 100 + counter), line, font=font, fill=(255, 0, 0))
-            else:
-                for lin in textwrap.wrap(line, width=100):
-                    I1.text((100, 100 + counter), lin, font=font, fill=(0, 0, 0))
-                    counter += 40
-                #I1.text((100, 100 + counter), line, font=font, fill=(0, 0, 0))
-            counter += 40
-    else:
-        counter = 0
-        for line in outputtext.splitlines():
-            for lin in textwrap.wrap(line, width=100):
-                    I1.text((100, 100 + counter), lin, font=font, fill=(0, 0, 0))
-                    counter += 40
-            counter += 40
-    return np.array(img)
+    # output list of lines, each {"text": str, "correct": bool}. "correct" is
+    # None without the solver
+    return [
+        {"text": line, "correct": bool(solve_str(line)) if enable_solver else None}
+        for line in page_layout(img, engine).lines
+    ]
 
 
 def setup_env():
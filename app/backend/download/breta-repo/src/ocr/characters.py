@@ -4,25 +4,33 @@ import os
 
 import cv2
 import numpy as np
-import tensorflow as tf
 
 from .helpers import *
-from .tfhelpers import Model
 
-# Preloading trained model with activation function
-# Loading is slow -> prevent multiple loads
-print("Loading segmentation models...")
 location = os.path.dirname(os.path.abspath(__file__))
-CNN_model = Model(os.path.join(location, "../../models/gap-clas/CNN-CG"))
 CNN_slider = (60, 30)
-RNN_model = Model(
-    os.path.join(location, "../../models/gap-clas/RNN/Bi-RNN-new"), "prediction"
-)
 RNN_slider = (60, 60)
 
 
+def load_models():
+    """Load trained models with activation function.
+    Loading is slow and imports TensorFlow -> loaded once per process by the
+    model registry of the app (backend/models.py), not at import."""
+    from .tfhelpers import Model
+
+    print("Loading segmentation models...")
+    CNN_model = Model(os.path.join(location, "../../models/gap-clas/CNN-CG"))
+    RNN_model = Model(
+        os.path.join(location, "../../models/gap-clas/RNN/Bi-RNN-new"), "prediction"
+    )
+    return CNN_model, RNN_model
+
+
 def _classify(img, step=2, RNN=False, slider=(60, 60)):
     """Slice the image and return raw output of classifier."""
+    from backend.models import get_model
+
+    CNN_model, RNN_model = get_model("segmentation")
     length = (img.shape[1] - slider[1]) // 2 + 1
     if RNN:
         input_seq = np.zeros((1, length, slider[0] * slider[1]), dtype=np.float32)
@@ -8,8 +8,18 @@ import numpy as np
 from .helpers import *
 
 
-def detection(image, area_thresh=0.5):
-    """Finding Page."""
+def detection(image, area_thresh=0.5, corners=None):
+    """Finding Page. `corners` as found by `page_corners` skips the search."""
+    if corners is None:
+        corners = page_corners(image, area_thresh)
+    # Transform prespective
+    new_image = _persp_transform(image, corners)
+    return new_image
+
+
+def page_corners(image, area_thresh=0.5):
+    """Corners of the page in the image: top-left, bot-left, bot-right,
+    top-right."""
     small = resize(image)
     # Edge detection
     image_edges = _edges_detection(small, 200, 250)
@@ -20,10 +30,7 @@ def detection(image, area_thresh=0.5):
     page_contour = _find_page_contours(closed_edges, small, area_thresh)
 
     # Recalculate to original scale
-    page_contour = page_contour.dot(ratio(image, small.shape[0]))
-    # Transform prespective
-    new_image = _persp_transform(image, page_contour)
-    return new_image
+    return page_contour.dot(ratio(image, small.shape[0]))
 
 
 def _edges_detection(img, minVal, maxVal):
@@ -1,23 +1,13 @@
-import copy
-import math
+import json
 import os
-import re
-from os import listdir
 
-import cv2
-import matplotlib.pyplot as plt
 import numpy as np
-import sklearn.model_selection as sk
 import tensorflow as tf
-import tensorflow.contrib.legacy_seq2seq as seq2seq
-from scipy import ndimage
-from Seq2SeqModel.Seq2SeqModel import Seq2SeqModel
-from skimage import io
-from skimage.transform import resize, rotate
-from skimage.util import invert, random_noise
+from Latex.LatexBase import LatexBase
+from Seq2SeqModel.Seq2SeqModel import CHECKPOINT_PATH, Seq2SeqModel, fold_constants
 
 
-class Latex(object):
+class Latex(LatexBase):
     def __init__(
         self,
         model_dir=None,
@@ -25,87 +15,42 @@ class Latex(object):
         std_train=None,
         plotting=False,
         verbose=False,
+        frozen_dir=None,
     ):
+        """
+        frozen_dir: directory of the inference graphs written by `freeze`,
+            loaded instead of the checkpoints they were frozen from
+        """
         tf.logging.set_verbosity(tf.logging.WARN)
         if model_dir is None:
             raise ValueError("model_dir needs to be defined")
-        if mean_train is None:
-            raise ValueError("mean_train needs to be defined")
-        if std_train is None:
-            raise ValueError("std_train needs to be defined")
+        LatexBase.__init__(self, mean_train, std_train, plotting, verbose)
 
         self.model_dir = model_dir
-        self.mean_train = mean_train
-        self.std_train = std_train
-        self.plotting = plotting
-        self.verbose = verbose
-        self.label_names = [
-            "0",
-            "1",
-            "2",
-            "3",
-            "4",
-            "5",
-            "6",
-            "7",
-            "8",
-            "9",
-            "-",
-            "+",
-            "=",
-            "leq",
-            "neq",
-            "geq",
-            "alpha",
-            "beta",
-            "lambda",
-            "lt",
-            "gt",
-            "x",
-            "y",
-        ]
-        self.ltokens = [
-            "0",
-            "1",
-            "2",
-            "3",
-            "4",
-            "5",
-            "6",
-            "7",
-            "8",
-            "9",
-            "-",
-            "+",
-            "=",
-            "#leq",
-            "#neq",
-            "#geq",
-            "#alpha",
-            "#beta",
-            "#lambda",
-            "#lt",
-            "#gt",
-            "x",
-            "y",
-            "^",
-            "#frac",
-            "{",
-            "}",
-            " ",
-        ]
-        self.nof_labels = len(self.label_names)
-        self.labels_dict = dict()
-        i = 0
-        for label in self.label_names:
-            self.labels_dict[label] = i
-            i += 1
-        self.classifier = tf.estimator.Estimator(
-            model_fn=self.cnn_model_fn, model_dir=self.model_dir
-        )
-        self.seqModel = Seq2SeqModel()
-        self.seq_sess = tf.Session()
-        self.seqModel.restore(self.seq_sess)
+        self._classifier = None
+        if frozen_dir is not None and self.frozen_is_current(frozen_dir):
+            self.load_frozen(frozen_dir)
+            return
+        if frozen_dir is not None:
+            print(
+                "Checkpoints changed since the graphs in %s were frozen, "
+                "restoring the checkpoints" % frozen_dir
+            )
+        self.load_classifier()
+        with tf.Graph().as_default():
+            self.seqModel = Seq2SeqModel(inference_only=True)
+            self.seq_sess = tf.Session()
+            self.seqModel.restore(self.seq_sess)
+
+    @property
+    def classifier(self):
+        """Estimator of the classifier, only built for training and
+        `classify_with_estimator`, prediction goes through `cnn_sess`"""
+        if self._classifier is None:
+            self._classifier = tf.estimator.Estimator(
+                model_fn=self.cnn_model_fn, model_dir=self.model_dir
+            )
+        return self._classifier
 
     def train(self, train_images, train_labels, steps):
         """Further train the network
@@ -132,101 +77,117 @@ class Latex(object):
             steps=steps,
         )
 
-    def normalize_single(self, symbol):
-        symbol = np.copy(symbol).astype(np.float32)
-
-        # range 0-1
-        symbol /= np.max(symbol)
-
-        rows, cols = symbol.shape
-        # scale to 40x40
-        inner_size = 40
-        if rows > cols:
-            factor = inner_size / rows
-            rows = inner_size
-            cols = int(round(cols * factor))
-            cols = cols if cols > 2 else 2
-            inner = cv2.resize(symbol, (cols, rows))
-        else:
-            factor = inner_size / cols
-            cols = inner_size
-            rows = int(round(rows * factor))
-            rows = rows if rows > 2 else 2
-            inner = cv2.resize(symbol, (cols, rows))
-
-        # pad to 48x48
-        outer_size = 48
-        colsPadding = (
-            int(math.ceil((outer_size - cols) / 2.0)),
-            int(math.floor((outer_size - cols) / 2.0)),
+    def load_classifier(self):
+        """Build the prediction graph of the classifier and restore the latest
+        checkpoint once, rather than on every call of `Estimator.predict`"""
+        checkpoint = tf.train.latest_checkpoint(self.model_dir)
+        if checkpoint is None:
+            raise ValueError("No checkpoint found in %s" % self.model_dir)
+
+        self.cnn_graph = tf.Graph()
+        with self.cnn_graph.as_default():
+            self.cnn_input = tf.placeholder(tf.float32, (None, 48, 48), "symbols")
+            spec = self.cnn_model_fn(
+                {"x": self.cnn_input}, None, tf.estimator.ModeKeys.PREDICT
+            )
+            self.cnn_probabilities = spec.predictions["probabilities"]
+            saver = tf.train.Saver()
+        self.cnn_sess = tf.Session(graph=self.cnn_graph)
+        saver.restore(self.cnn_sess, checkpoint)
+
+    def checkpoints(self):
+        """Path and modification time of the checkpoints of the classifier
+        and the sequence model"""
+        paths = {
+            "cnn": tf.train.latest_checkpoint(self.model_dir),
+            "seq2seq": CHECKPOINT_PATH,
+        }
+        return {
+            name: [path, path and os.path.getmtime(path + ".index")]
+            for name, path in paths.items()
+        }
+
+    def frozen_is_current(self, frozen_dir):
+        """Whether the graphs in `frozen_dir` were frozen from the current
+        checkpoints, which a retrained model replaces"""
+        try:
+            with open(os.path.join(frozen_dir, "checkpoints.json")) as f:
+                return json.load(f) == self.checkpoints()
+        except (OSError, ValueError):
+            return False
+
+    def freeze(self, frozen_dir):
+        """Write inference-only graphs of the classifier and the sequence
+        model, with the restored variables and everything computed from them
+        folded into constants, and the checkpoints they came from"""
+        cnn_graph_def = tf.graph_util.convert_variables_to_constants(
+            self.cnn_sess, self.cnn_graph.as_graph_def(), ["softmax_tensor"]
         )
-        rowsPadding = (
-            int(math.ceil((outer_size - rows) / 2.0)),
-            int(math.floor((outer_size - rows) / 2.0)),
+        cnn_graph_def = tf.graph_util.remove_training_nodes(
+            cnn_graph_def, protected_nodes=["symbols", "softmax_tensor"]
         )
-        outer = np.pad(
-            inner, (rowsPadding, colsPadding), "constant", constant_values=(1, 1)
+        cnn_graph_def = fold_constants(cnn_graph_def, ["softmax_tensor"])
+        seq_graph_def = self.seqModel.freeze(self.seq_sess)
+
+        os.makedirs(frozen_dir, exist_ok=True)
+        for name, graph_def in [("cnn", cnn_graph_def), ("seq2seq", seq_graph_def)]:
+            with open(os.path.join(frozen_dir, name + ".pb"), "wb") as f:
+                f.write(graph_def.SerializeToString())
+        with open(os.path.join(frozen_dir, "checkpoints.json"), "w") as f:
+            json.dump(self.checkpoints(), f)
+
+    def load_frozen(self, frozen_dir):
+        graph_defs = {}
+        for name in ["cnn", "seq2seq"]:
+            graph_defs[name] = tf.GraphDef()
+            with open(os.path.join(frozen_dir, name + ".pb"), "rb") as f:
+                graph_defs[name].ParseFromString(f.read())
+
+        self.cnn_graph = tf.Graph()
+        with self.cnn_graph.as_default():
+            tf.import_graph_def(graph_defs["cnn"], name="")
+        self.cnn_input = self.cnn_graph.get_tensor_by_name("symbols:0")
+        self.cnn_probabilities = self.cnn_graph.get_tensor_by_name("softmax_tensor:0")
+        # Constants were folded by `freeze`, running Grappler again on the
+        # first call would copy the weights and take seconds
+        config = tf.ConfigProto()
+        config.graph_options.rewrite_options.disable_meta_optimizer = True
+        self.cnn_sess = tf.Session(graph=self.cnn_graph, config=config)
+
+        self.seqModel = Seq2SeqModel(frozen_graph=graph_defs["seq2seq"])
+        self.seq_sess = tf.Session(graph=self.seqModel.graph, config=config)
+
+    def classify(self, symbols):
+        """Classify normalized symbols in a single run
+
+        Parameters
+        ----------
+        symbols : numpy array [X,48,48]
+            Normalized symbol images (-mean /std)
+
+        Returns
+        -------
+        numpy array [X,nof_labels] of class probabilities
+        """
+        if len(symbols) == 0:
+            return np.zeros((0, self.nof_labels), dtype=np.float32)
+        return self.cnn_sess.run(
+            self.cnn_probabilities,
+            feed_dict={self.cnn_input: np.asarray(symbols, dtype=np.float32)},
         )
 
-        # center the mass
-        shiftx, shifty = self.getBestShift(outer)
-        shifted = self.shift(outer, shiftx, shifty)
-        return shifted
-
-    def getBestShift(self, img):
-        inv = invert(img)
-        cy, cx = ndimage.measurements.center_of_mass(inv)
-
-        rows, cols = img.shape
-        shiftx = np.round(cols / 2.0 - cx).astype(int)
-        shifty = np.round(rows / 2.0 - cy).astype(int)
-
-        return shiftx, shifty
-
-    def shift(self, img, sx, sy):
-        rows, cols = img.shape
-        M = np.float32([[1, 0, sx], [0, 1, sy]])
-        shifted = cv2.warpAffine(img, M, (cols, rows), borderValue=1)
-        return shifted
-
-    def add_rectangles(self, img, bounding_boxes):
-        img_color = np.asarray(np.dstack((img, img, img)), dtype=np.uint8)
-        for bounding_box in bounding_boxes:
-            xmin, xmax = bounding_box["xmin"], bounding_box["xmax"]
-            ymin, ymax = bounding_box["ymin"], bounding_box["ymax"]
-            img_color[ymin, xmin:xmax] = [255, 0, 0]
-            img_color[ymax - 1, xmin:xmax] = [255, 0, 0]
-            img_color[ymin:ymax, xmin] = [255, 0, 0]
-            img_color[ymin:ymax, xmax - 1] = [255, 0, 0]
-        return img_color
-
-    def crop(self, img):
-        crop = np.copy(img) / 255
-        h, w = img.shape
-        left = 0
-        while left < w // 2 and np.sum(crop[:, left]) >= 0.98 * h:
-            left += 1
-        right = w - 1
-        while right > w // 2 and np.sum(crop[:, right]) >= 0.98 * h:
-            right -= 1
-        if left > 0:
-            left - 1
-        if right < h - 1:
-            right += 1
-        crop = crop[:, left:right]
-
-        top = 0
-        while top < h // 2 and np.sum(crop[top, :]) >= 0.98 * w:
-            top += 1
-        bottom = h - 1
-        while bottom > h // 2 and np.sum(crop[bottom, :]) >= 0.98 * w:
-            bottom -= 1
-        if top > 0:
-            top -= 1
-        if bottom < h - 1:
-            bottom += 1
-        crop = crop[top:bottom, :] * 255
-        return crop
+    def classify_with_estimator(self, symbols):
+        """Classify through the estimator, which builds the graph and restores
+        the checkpoint on every call. Kept to compare against `classify`"""
+        eval_input_fn = tf.estimator.inputs.numpy_input_fn(
+            x={"x": np.asarray(symbols, dtype=np.float32)}, shuffle=False
+        )
+        return np.array(
+            [
+                pred_result["probabilities"]
+                for pred_result in self.classifier.predict(input_fn=eval_input_fn)
+            ]
+        ).reshape(-1, self.nof_labels)
 
     def cnn_model_fn(self, features, labels, mode):
         input_layer = tf.reshape(features["x"], [-1, 48, 48, 1])
@@ -300,174 +261,5 @@ class Latex(object):
             mode=mode, loss=loss, eval_metric_ops=eval_metric_ops
         )
 
-    def get_bounding_boxes(self):
-        ret, thresh = cv2.threshold(self.formula, 220, 255, cv2.THRESH_BINARY_INV)
-        """
-        if self.plotting:
-            print("Start threshold: ")
-            plt.figure(figsize=(20,10)) 
-            plt.imshow(thresh, cmap="gray")
-            plt.show()
-        """
-        # _, contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL,cv2.CHAIN_APPROX_SIMPLE)
-        contours, _ = cv2.findContours(
-            thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE
-        )
-
-        bounding_boxes = []
-        id_c = 0
-        for cnt in contours:
-            x, y, w, h = cv2.boundingRect(cnt)
-            # bounding boxes should not be too small
-            if h > 10 or w > 10:
-                bounding_boxes.append(
-                    {
-                        "id": id_c,
-                        "xmin": x,
-                        "xmax": x + w,
-                        "ymin": y,
-                        "ymax": y + h,
-                        "combined": [],
-                    }
-                )
-                id_c += 1
-        bounding_boxes = sorted(bounding_boxes, key=lambda k: (k["xmin"], k["ymin"]))
-        formula_rects = self.add_rectangles(self.formula, bounding_boxes)
-        """
-        if self.plotting:
-            print("Start bounding boxes: ")
-            plt.figure(figsize=(20,10)) 
-            plt.imshow(formula_rects, cmap="gray")
-            plt.show()
-        """
-
-        self.bounding_boxes = bounding_boxes
-
-    def normalize(self):
-        self.possible_symbol_img = []
-        self.pred_pos = []
-        for bounding_box in self.bounding_boxes:
-            xmin, xmax = bounding_box["xmin"], bounding_box["xmax"]
-            ymin, ymax = bounding_box["ymin"], bounding_box["ymax"]
-            dy = ymax - ymin
-            dx = xmax - xmin
-
-            normalized = self.normalize_single(self.formula[ymin:ymax, xmin:xmax])
-            normalized -= self.mean_train
-            normalized /= self.std_train
-
-            self.possible_symbol_img.append(normalized)
-            self.pred_pos.append(bounding_box)
-
-    def predict(self, formula):
-        self.formula = formula
-        self.get_bounding_boxes()
-        self.normalize()
-
-        eval_input_fn = tf.estimator.inputs.numpy_input_fn(
-            x={"x": np.array(self.possible_symbol_img)}, shuffle=False
-        )
-
-        pred_results = self.classifier.predict(input_fn=eval_input_fn)
-        good_bounding_boxes = []
-        formula_text = ""
-
-        pred_pos = self.pred_pos
-
-        skip = []
-        c = 0
-
-        lastYmin = None
-        lastYmax = None
-        for pred_result, pos in zip(pred_results, pred_pos):
-            symbol_no = pred_result["classes"]
-            symbol = self.label_names[symbol_no]
-            acc = pred_result["probabilities"][symbol_no]
-            if self.verbose:
-                print("Recognized a %s with %.2f %% accuracy" % (symbol, acc * 100))
-
-            xmin, xmax = pos["xmin"], pos["xmax"]
-            ymin, ymax = pos["ymin"], pos["ymax"]
-
-            good_bounding_boxes.append(
-                {
-                    "xmin": xmin,
-                    "xmax": xmax,
-                    "ymin": ymin,
-                    "ymax": ymax,
-                    "symbol": symbol,
-                    "probs": pred_result["probabilities"],
-                }
-            )
-            formula_text += symbol
-
-            lastYmax = ymax
-            lastYmin = ymin
-            c += 1
-
-        seq_data = self.seqModel.get_sequence_data(
-            self.formula, self.nof_labels, good_bounding_boxes
-        )
-
-        bb_image = self.add_rectangles(formula, good_bounding_boxes)
-
-        seq = self.seqModel.predict_single(self.seq_sess, seq_data[:26])
-
-        return {
-            "equation": seq,
-            "seq_data": seq_data,
-            "formula": self.post_process_latex(formula_text),
-            "output_image": bb_image,
-            "data": good_bounding_boxes,
-        }
-
-    def post_process_latex(self, formula_text):
-        formula_text = formula_text.replace("=", " = ")
-        for symbol in ["leq", "neq", "geq"]:
-            formula_text = formula_text.replace(symbol, " \\" + symbol + " ")
-        for symbol in ["lambda", "alpha", "beta"]:
-            formula_text = formula_text.replace(symbol, "\\" + symbol)
-        formula_text = formula_text.replace("#lt", "<")
-        formula_text = formula_text.replace("#gt", ">")
-        return formula_text
-
-    def filename2formula(self, filename):
-        pos = filename.rfind("_")
-        correct = filename[:pos]
-        for symbol in ["leq", "neq", "geq", "lambda", "alpha", "beta", "frac"]:
-            correct = correct.replace("#" + symbol, "\\" + symbol)
-        correct = correct.replace("#lt", "<")
-        correct = correct.replace("#gt", ">")
-        return correct
-
-    def filename2seq(self, filename):
-        """Convert a filename to the sequence array"""
-        pos = filename.rfind("_")
-        correct = filename[:pos]
-        parts = list(correct)
-        tokens = []
-        pi = -1
-        pattern = re.compile("(#|[a-z])")
-        while pi < len(parts) - 1:
-            pi += 1
-            p = parts[pi]
-            if p != "#":
-                tokens.append(p)
-            else:
-                sp = pi
-                while pattern.match(p):
-                    pi += 1
-                    p = parts[pi]
-                tokens.append("".join(parts[sp:pi]))
-                pi -= 1
-
-        tokens_dict = dict()
-        i = 0
-        for label in self.ltokens:
-            tokens_dict[label] = i
-            i += 1
-
-        seq = []
-        for token in tokens:
-            seq.append(tokens_dict[token])
-        return seq
+    def decode(self, seq_data):
+        return self.seqModel.predict_batch(self.seq_sess, seq_data)
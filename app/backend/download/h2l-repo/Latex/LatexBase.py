@@ -0,0 +1,405 @@
+import math
+import re
+
+import cv2
+import numpy as np
+
+
+def get_sequence_data(formula, nlabels, bb):
+    height, width = formula.shape
+    last_xmax = 0
+    last_ymin = bb[0]["ymin"] if bb else 0
+    step_c = -1
+    nclasses = (
+        nlabels + 4 + 2 + 1
+    )  # 1 for pad and 4 for relative pos, 2 for abs pos and shift from last and width
+    seq = np.zeros((300, nclasses))
+    # Noisy word boxes can have more symbols than fit, only the first steps
+    # are decoded anyway
+    for step in bb[: len(seq)]:
+        step_c += 1
+        seq[step_c][:nlabels] = step["probs"]
+        seq[step_c][-1] = 0  # remove pad
+        seq[step_c][-7] = step["xmin"] / width
+        seq[step_c][-6] = step["ymin"] / height
+        seq[step_c][-5] = (step["xmin"] - last_xmax) / 10
+        last_xmax = step["xmax"]
+        seq[step_c][-4] = (step["xmax"] - step["xmin"]) / 48
+        seq[step_c][-3] = (step["ymin"] - last_ymin) / 10
+        seq[step_c][-2] = (step["ymax"] - step["ymin"]) / 48
+        last_ymin = step["ymin"]
+    return seq
+
+
+class LatexBase(object):
+    """Symbol detection, normalization and post-processing of the
+    handwriting-to-LaTeX model, which need no TensorFlow. Subclasses classify
+    the symbols in `classify` and decode their sequences in `decode`."""
+
+    def __init__(
+        self,
+        mean_train=None,
+        std_train=None,
+        plotting=False,
+        verbose=False,
+    ):
+        if mean_train is None:
+            raise ValueError("mean_train needs to be defined")
+        if std_train is None:
+            raise ValueError("std_train needs to be defined")
+
+        self.mean_train = mean_train
+        self.std_train = std_train
+        self.plotting = plotting
+        self.verbose = verbose
+        self.label_names = [
+            "0",
+            "1",
+            "2",
+            "3",
+            "4",
+            "5",
+            "6",
+            "7",
+            "8",
+            "9",
+            "-",
+            "+",
+            "=",
+            "leq",
+            "neq",
+            "geq",
+            "alpha",
+            "beta",
+            "lambda",
+            "lt",
+            "gt",
+            "x",
+            "y",
+        ]
+        self.ltokens = [
+            "0",
+            "1",
+            "2",
+            "3",
+            "4",
+            "5",
+            "6",
+            "7",
+            "8",
+            "9",
+            "-",
+            "+",
+            "=",
+            "#leq",
+            "#neq",
+            "#geq",
+            "#alpha",
+            "#beta",
+            "#lambda",
+            "#lt",
+            "#gt",
+            "x",
+            "y",
+            "^",
+            "#frac",
+            "{",
+            "}",
+            " ",
+        ]
+        self.nof_labels = len(self.label_names)
+        self.labels_dict = dict()
+        i = 0
+        for label in self.label_names:
+            self.labels_dict[label] = i
+            i += 1
+
+    def normalize_single(self, symbol):
+        symbol = np.copy(symbol).astype(np.float32)
+
+        # range 0-1
+        symbol /= np.max(symbol)
+
+        rows, cols = symbol.shape
+        # scale to 40x40
+        inner_size = 40
+        if rows > cols:
+            factor = inner_size / rows
+            rows = inner_size
+            cols = int(round(cols * factor))
+            cols = cols if cols > 2 else 2
+            inner = cv2.resize(symbol, (cols, rows))
+        else:
+            factor = inner_size / cols
+            cols = inner_size
+            rows = int(round(rows * factor))
+            rows = rows if rows > 2 else 2
+            inner = cv2.resize(symbol, (cols, rows))
+
+        # pad to 48x48
+        outer_size = 48
+        colsPadding = (
+            int(math.ceil((outer_size - cols) / 2.0)),
+            int(math.floor((outer_size - cols) / 2.0)),
+        )
+        rowsPadding = (
+            int(math.ceil((outer_size - rows) / 2.0)),
+            int(math.floor((outer_size - rows) / 2.0)),
+        )
+        outer = np.pad(
+            inner, (rowsPadding, colsPadding), "constant", constant_values=(1, 1)
+        )
+
+        # center the mass
+        shiftx, shifty = self.getBestShift(outer)
+        shifted = self.shift(outer, shiftx, shifty)
+        return shifted
+
+    def getBestShift(self, img):
+        # Center of mass of the ink, as scipy.ndimage.center_of_mass of the
+        # inverted image
+        inv = np.subtract(1, img, dtype=img.dtype)
+        ys, xs = np.ogrid[: inv.shape[0], : inv.shape[1]]
+        total = inv.sum()
+        cy = (inv * ys.astype(float)).sum() / total
+        cx = (inv * xs.astype(float)).sum() / total
+
+        rows, cols = img.shape
+        shiftx = np.round(cols / 2.0 - cx).astype(int)
+        shifty = np.round(rows / 2.0 - cy).astype(int)
+
+        return shiftx, shifty
+
+    def shift(self, img, sx, sy):
+        rows, cols = img.shape
+        M = np.float32([[1, 0, sx], [0, 1, sy]])
+        shifted = cv2.warpAffine(img, M, (cols, rows), borderValue=1)
+        return shifted
+
+    def add_rectangles(self, img, bounding_boxes):
+        img_color = np.asarray(np.dstack((img, img, img)), dtype=np.uint8)
+        for bounding_box in bounding_boxes:
+            xmin, xmax = bounding_box["xmin"], bounding_box["xmax"]
+            ymin, ymax = bounding_box["ymin"], bounding_box["ymax"]
+            img_color[ymin, xmin:xmax] = [255, 0, 0]
+            img_color[ymax - 1, xmin:xmax] = [255, 0, 0]
+            img_color[ymin:ymax, xmin] = [255, 0, 0]
+            img_color[ymin:ymax, xmax - 1] = [255, 0, 0]
+        return img_color
+
+    def crop(self, img):
+        crop = np.copy(img) / 255
+        h, w = img.shape
+        left = 0
+        while left < w // 2 and np.sum(crop[:, left]) >= 0.98 * h:
+            left += 1
+        right = w - 1
+        while right > w // 2 and np.sum(crop[:, right]) >= 0.98 * h:
+            right -= 1
+        if left > 0:
+            left - 1
+        if right < h - 1:
+            right += 1
+        crop = crop[:, left:right]
+
+        top = 0
+        while top < h // 2 and np.sum(crop[top, :]) >= 0.98 * w:
+            top += 1
+        bottom = h - 1
+        while bottom > h // 2 and np.sum(crop[bottom, :]) >= 0.98 * w:
+            bottom -= 1
+        if top > 0:
+            top -= 1
+        if bottom < h - 1:
+            bottom += 1
+        crop = crop[top:bottom, :] * 255
+        return crop
+
+    def get_bounding_boxes(self, formula):
+        ret, thresh = cv2.threshold(formula, 220, 255, cv2.THRESH_BINARY_INV)
+        """
+        if self.plotting:
+            print("Start threshold: ")
+            plt.figure(figsize=(20,10)) 
+            plt.imshow(thresh, cmap="gray")
+            plt.show()
+        """
+        # _, contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL,cv2.CHAIN_APPROX_SIMPLE)
+        contours, _ = cv2.findContours(
+            thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE
+        )
+
+        bounding_boxes = []
+        id_c = 0
+        for cnt in contours:
+            x, y, w, h = cv2.boundingRect(cnt)
+            # bounding boxes should not be too small
+            if h > 10 or w > 10:
+                bounding_boxes.append(
+                    {
+                        "id": id_c,
+                        "xmin": x,
+                        "xmax": x + w,
+                        "ymin": y,
+                        "ymax": y + h,
+                        "combined": [],
+                    }
+                )
+                id_c += 1
+        bounding_boxes = sorted(bounding_boxes, key=lambda k: (k["xmin"], k["ymin"]))
+        formula_rects = self.add_rectangles(formula, bounding_boxes)
+        """
+        if self.plotting:
+            print("Start bounding boxes: ")
+            plt.figure(figsize=(20,10)) 
+            plt.imshow(formula_rects, cmap="gray")
+            plt.show()
+        """
+
+        return bounding_boxes
+
+    def normalize(self, formula, bounding_boxes):
+        possible_symbol_img = []
+        pred_pos = []
+        for bounding_box in bounding_boxes:
+            xmin, xmax = bounding_box["xmin"], bounding_box["xmax"]
+            ymin, ymax = bounding_box["ymin"], bounding_box["ymax"]
+            dy = ymax - ymin
+            dx = xmax - xmin
+
+            normalized = self.normalize_single(formula[ymin:ymax, xmin:xmax])
+            normalized -= self.mean_train
+            normalized /= self.std_train
+
+            possible_symbol_img.append(normalized)
+            pred_pos.append(bounding_box)
+
+        return pred_pos, possible_symbol_img
+
+    def detect_symbols(self, formula):
+        """Bounding boxes and normalized images of the symbols of a formula.
+        Nothing is kept on the model, which concurrent callers may share"""
+        return self.normalize(formula, self.get_bounding_boxes(formula))
+
+    def predict(self, formula):
+        return self.predict_batch([formula])[0]
+
+    def predict_batch(self, formulas):
+        """Recognize several formulas, e.g. all word boxes of a page, with the
+        symbols of all formulas classified in a single run"""
+        pred_pos, symbols = [], []
+        for formula in formulas:
+            positions, images = self.detect_symbols(formula)
+            pred_pos.append(positions)
+            symbols.extend(images)
+
+        probabilities = self.classify(symbols)
+
+        results = []
+        start = 0
+        for formula, positions in zip(formulas, pred_pos):
+            results.append(
+                self.formula_result(
+                    formula, positions, probabilities[start : start + len(positions)]
+                )
+            )
+            start += len(positions)
+
+        # Sequences of all formulas are decoded together
+        equations = self.decode([result["seq_data"][:26] for result in results])
+        for result, equation in zip(results, equations):
+            result["equation"] = equation
+        return results
+
+    def formula_result(self, formula, pred_pos, probabilities):
+        good_bounding_boxes = []
+        formula_text = ""
+
+        for probs, pos in zip(probabilities, pred_pos):
+            symbol_no = probs.argmax()
+            symbol = self.label_names[symbol_no]
+            acc = probs[symbol_no]
+            if self.verbose:
+                print("Recognized a %s with %.2f %% accuracy" % (symbol, acc * 100))
+
+            good_bounding_boxes.append(
+                {
+                    "xmin": pos["xmin"],
+                    "xmax": pos["xmax"],
+                    "ymin": pos["ymin"],
+                    "ymax": pos["ymax"],
+                    "symbol": symbol,
+                    "probs": probs,
+                }
+            )
+            formula_text += symbol
+
+        seq_data = get_sequence_data(formula, self.nof_labels, good_bounding_boxes)
+
+        bb_image = self.add_rectangles(formula, good_bounding_boxes)
+
+        return {
+            "seq_data": seq_data,
+            "formula": self.post_process_latex(formula_text),
+            "output_image": bb_image,
+            "data": good_bounding_boxes,
+        }
+
+    def post_process_latex(self, formula_text):
+        formula_text = formula_text.replace("=", " = ")
+        for symbol in ["leq", "neq", "geq"]:
+            formula_text = formula_text.replace(symbol, " \\" + symbol + " ")
+        for symbol in ["lambda", "alpha", "beta"]:
+            formula_text = formula_text.replace(symbol, "\\" + symbol)
+        formula_text = formula_text.replace("#lt", "<")
+        formula_text = formula_text.replace("#gt", ">")
+        return formula_text
+
+    def filename2formula(self, filename):
+        pos = filename.rfind("_")
+        correct = filename[:pos]
+        for symbol in ["leq", "neq", "geq", "lambda", "alpha", "beta", "frac"]:
+            correct = correct.replace("#" + symbol, "\\" + symbol)
+        correct = correct.replace("#lt", "<")
+        correct = correct.replace("#gt", ">")
+        return correct
+
+    def filename2seq(self, filename):
+        """Convert a filename to the sequence array"""
+        pos = filename.rfind("_")
+        correct = filename[:pos]
+        parts = list(correct)
+        tokens = []
+        pi = -1
+        pattern = re.compile("(#|[a-z])")
+        while pi < len(parts) - 1:
+            pi += 1
+            p = parts[pi]
+            if p != "#":
+                tokens.append(p)
+            else:
+                sp = pi
+                while pattern.match(p):
+                    pi += 1
+                    p = parts[pi]
+                tokens.append("".join(parts[sp:pi]))
+                pi -= 1
+
+        tokens_dict = dict()
+        i = 0
+        for label in self.ltokens:
+            tokens_dict[label] = i
+            i += 1
+
+        seq = []
+        for token in tokens:
+            seq.append(tokens_dict[token])
+        return seq
+
+    def classify(self, symbols):
+        """Class probabilities [X,nof_labels] of normalized symbols [X,48,48]"""
+        raise NotImplementedError
+
+    def decode(self, seq_data):
+        """Latex strings of the sequence data [X,26,30] of X formulas"""
+        raise NotImplementedError
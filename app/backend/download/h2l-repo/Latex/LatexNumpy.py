@@ -0,0 +1,278 @@
+import os
+
+import numpy as np
+from Latex.LatexBase import LatexBase
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Checkpoint variables of `Latex.cnn_model_fn` and `Seq2SeqModel`, saved under
+# the same names by `export_weights`
+CNN_VARIABLES = [
+    "conv2d/kernel",
+    "conv2d/bias",
+    "conv2d_1/kernel",
+    "conv2d_1/bias",
+    "conv2d_2/kernel",
+    "conv2d_2/bias",
+    "dense/kernel",
+    "dense/bias",
+    "dense_1/kernel",
+    "dense_1/bias",
+]
+SEQ2SEQ_VARIABLES = [
+    "dec_embedding",
+    "encoding/rnn/basic_lstm_cell/kernel",
+    "encoding/rnn/basic_lstm_cell/bias",
+    "decoding/rnn/basic_lstm_cell/kernel",
+    "decoding/rnn/basic_lstm_cell/bias",
+    "fully_connected/weights",
+    "fully_connected/biases",
+]
+# Default of tf.contrib.rnn.BasicLSTMCell
+FORGET_BIAS = 1.0
+# Symbols per forward pass of the CNN, to bound the size of the activations
+CNN_BATCH_SIZE = 64
+# Convolutions unfold the patches of as many symbols at a time as fit in this
+# many bytes, which is faster than larger batches that do not fit in cache
+UNFOLD_MAX_BYTES = 8 * 1024 * 1024
+Y_SEQ_LENGTH = 25
+# Storage of the dense layers of the CNN, which hold nearly all of the
+# weights, and of the LSTM kernels. Computations are in float32 either way
+PRECISIONS = ["float32", "float16"]
+# Stores the dense layers with one scale per output channel. Not in PRECISIONS
+# until its agreement with float32 has been checked on the trained weights,
+# so only `precision_report` runs it
+UNVERIFIED_PRECISIONS = ["int8"]
+LSTM_KERNELS = [
+    "encoding/rnn/basic_lstm_cell/kernel",
+    "decoding/rnn/basic_lstm_cell/kernel",
+]
+# Variables stored at reduced precision, and at which, for each precision;
+# all others stay in float32. The convolutions and embeddings are small. LSTM
+# kernels in int8 change a third of the decoded equations, even with one scale
+# per output channel and group of 8 rows, so they are kept in float16
+REDUCED_PRECISION_VARIABLES = {
+    "float16": {
+        "dense/kernel": "float16",
+        "dense_1/kernel": "float16",
+        **{kernel: "float16" for kernel in LSTM_KERNELS},
+    },
+    "int8": {
+        "dense/kernel": "int8",
+        "dense_1/kernel": "int8",
+        **{kernel: "float16" for kernel in LSTM_KERNELS},
+    },
+}
+# Rows of a reduced-precision dense layer brought back to float32 at a time
+DEQUANTIZE_ROWS = 256
+
+
+def export_weights(cnn_checkpoint, seq_checkpoint, weights_dir):
+    """Save the trained variables as cnn.npz and seq2seq.npz, the only step
+    that needs TensorFlow"""
+    import tensorflow as tf
+
+    os.makedirs(weights_dir, exist_ok=True)
+    for name, checkpoint, variables in [
+        ("cnn", cnn_checkpoint, CNN_VARIABLES),
+        ("seq2seq", seq_checkpoint, SEQ2SEQ_VARIABLES),
+    ]:
+        reader = tf.train.load_checkpoint(checkpoint)
+        np.savez(
+            os.path.join(weights_dir, name + ".npz"),
+            **{variable: reader.get_tensor(variable) for variable in variables}
+        )
+
+
+def load_weights(path, precision="float32"):
+    reduced = REDUCED_PRECISION_VARIABLES.get(precision, {})
+    with np.load(path) as weights:
+        return {
+            name: quantize(
+                weights[name].astype(np.float32), reduced.get(name, "float32")
+            )
+            for name in weights.files
+        }
+
+
+def quantize(weight, precision):
+    if weight.ndim < 2 or precision == "float32":
+        return weight
+    if precision == "float16":
+        return weight.astype(np.float16)
+    if precision == "int8":
+        # Symmetric, per output channel (last axis)
+        scale = np.abs(weight).max(axis=tuple(range(weight.ndim - 1))) / 127
+        scale[scale == 0] = 1
+        return np.round(weight / scale).astype(np.int8), scale.astype(np.float32)
+    raise ValueError(
+        "precision needs to be one of %s" % (PRECISIONS + UNVERIFIED_PRECISIONS)
+    )
+
+
+def matmul(x, weight):
+    """x @ weight for a weight in any of `PRECISIONS`, without a float32 copy
+    of the whole matrix"""
+    if not isinstance(weight, tuple) and weight.dtype == np.float32:
+        return x @ weight
+    weight, scale = weight if isinstance(weight, tuple) else (weight, 1)
+    out = np.zeros((len(x), weight.shape[1]), dtype=np.float32)
+    for start in range(0, len(weight), DEQUANTIZE_ROWS):
+        rows = slice(start, start + DEQUANTIZE_ROWS)
+        out += x[:, rows] @ weight[rows].astype(np.float32)
+    # Per output channel, so it applies to the sum
+    return out * scale
+
+
+def weights_nbytes(weights):
+    return sum(
+        sum(w.nbytes for w in weight) if isinstance(weight, tuple) else weight.nbytes
+        for weight in weights.values()
+    )
+
+
+def conv2d_same(x, kernel, bias):
+    """Stride 1, "same" padding, NHWC like tf.layers.conv2d, as one matrix
+    product over the unfolded patches"""
+    kh, kw, cin, cout = kernel.shape
+    n, h, w, _ = x.shape
+    x = np.pad(x, ((0, 0), (kh // 2, kh // 2), (kw // 2, kw // 2), (0, 0)))
+    kernel = kernel.reshape(kh * kw * cin, cout)
+    step = max(1, UNFOLD_MAX_BYTES // (h * w * kh * kw * cin * 4))
+
+    out = np.empty((n, h, w, cout), dtype=np.float32)
+    for start in range(0, n, step):
+        # (n, h, w, cin, kh, kw) windows, reordered like the kernel
+        patches = sliding_window_view(x[start : start + step], (kh, kw), axis=(1, 2))
+        patches = patches.transpose(0, 1, 2, 4, 5, 3).reshape(-1, kh * kw * cin)
+        out[start : start + step] = (patches @ kernel + bias).reshape(-1, h, w, cout)
+    return out
+
+
+def max_pool_2x2(x):
+    n, h, w, c = x.shape
+    return x.reshape(n, h // 2, 2, w // 2, 2, c).max(axis=(2, 4))
+
+
+def relu(x):
+    return np.maximum(x, 0, out=x)
+
+
+def softmax(x):
+    x = np.exp(x - x.max(axis=-1, keepdims=True))
+    return x / x.sum(axis=-1, keepdims=True)
+
+
+def sigmoid(x):
+    # Same as scipy.special.expit, without the dependency
+    return 0.5 * (1 + np.tanh(0.5 * x))
+
+
+def lstm_step(x, c, h, kernel, bias):
+    """One step of tf.contrib.rnn.BasicLSTMCell"""
+    i, j, f, o = np.split(
+        matmul(np.concatenate([x, h], axis=1), kernel) + bias, 4, axis=1
+    )
+    c = c * sigmoid(f + FORGET_BIAS) + sigmoid(i) * np.tanh(j)
+    h = np.tanh(c) * sigmoid(o)
+    return c, h
+
+
+class LatexNumpy(LatexBase):
+    """Inference of `Latex` in NumPy, on the weights saved by
+    `export_weights`. Gives the same results without importing TensorFlow."""
+
+    def __init__(
+        self,
+        weights_dir=None,
+        mean_train=None,
+        std_train=None,
+        plotting=False,
+        verbose=False,
+        precision="float32",
+        unverified=False,
+    ):
+        """
+        precision: storage of the dense layers of the CNN and the LSTM
+            kernels, one of `PRECISIONS`. float16 holds about a half of the
+            memory, the weights are brought back to float32 while the layer
+            runs
+        unverified: also accept `UNVERIFIED_PRECISIONS`, int8 holding about
+            a third of the memory
+        """
+        if weights_dir is None:
+            raise ValueError("weights_dir needs to be defined")
+        precisions = PRECISIONS + (UNVERIFIED_PRECISIONS if unverified else [])
+        if precision not in precisions:
+            raise ValueError("precision needs to be one of %s" % precisions)
+        LatexBase.__init__(self, mean_train, std_train, plotting, verbose)
+
+        self.precision = precision
+        self.cnn = load_weights(os.path.join(weights_dir, "cnn.npz"), precision)
+        self.seq = load_weights(os.path.join(weights_dir, "seq2seq.npz"), precision)
+
+    @property
+    def nbytes(self):
+        return weights_nbytes(self.cnn) + weights_nbytes(self.seq)
+
+    def classify(self, symbols):
+        symbols = np.asarray(symbols, dtype=np.float32).reshape(-1, 48, 48, 1)
+        return np.concatenate(
+            [
+                self.cnn_forward(symbols[start : start + CNN_BATCH_SIZE])
+                for start in range(0, len(symbols), CNN_BATCH_SIZE)
+            ]
+            or [np.zeros((0, self.nof_labels), dtype=np.float32)]
+        )
+
+    def cnn_forward(self, x):
+        """`Latex.cnn_model_fn` in PREDICT mode, dropout being off"""
+        w = self.cnn
+        for layer in ["conv2d", "conv2d_1", "conv2d_2"]:
+            x = conv2d_same(x, w[layer + "/kernel"], w[layer + "/bias"])
+            x = max_pool_2x2(relu(x))
+        x = relu(matmul(x.reshape(len(x), -1), w["dense/kernel"]) + w["dense/bias"])
+        return softmax(matmul(x, w["dense_1/kernel"]) + w["dense_1/bias"])
+
+    def decode(self, seq_data):
+        """Greedy decoding as in `Seq2SeqModel.predict_batch`"""
+        if len(seq_data) == 0:
+            return []
+        w = self.seq
+        xs = np.asarray(seq_data, dtype=np.float32)
+        nodes = w["encoding/rnn/basic_lstm_cell/bias"].shape[0] // 4
+
+        c = np.zeros((len(xs), nodes), dtype=np.float32)
+        h = np.zeros((len(xs), nodes), dtype=np.float32)
+        for t in range(xs.shape[1]):
+            c, h = lstm_step(
+                xs[:, t],
+                c,
+                h,
+                w["encoding/rnn/basic_lstm_cell/kernel"],
+                w["encoding/rnn/basic_lstm_cell/bias"],
+            )
+
+        pad = len(self.ltokens)
+        dec_input = np.full(len(xs), pad)
+        finished = np.zeros(len(xs), dtype=bool)
+        predictions = []
+        for i in range(Y_SEQ_LENGTH):
+            c, h = lstm_step(
+                w["dec_embedding"][dec_input],
+                c,
+                h,
+                w["decoding/rnn/basic_lstm_cell/kernel"],
+                w["decoding/rnn/basic_lstm_cell/bias"],
+            )
+            logits = h @ w["fully_connected/weights"] + w["fully_connected/biases"]
+            dec_input = logits.argmax(axis=-1)
+            # A sequence ends at its first padding token
+            finished |= dec_input == pad
+            predictions.append(np.where(finished, pad, dec_input))
+            if finished.all():
+                break
+
+        return [
+            "".join(self.ltokens[token] for token in seq if token < pad)
+            for seq in np.array(predictions).T
+        ]
@@ -5,10 +5,48 @@ import math
 import numpy as np
 import tensorflow as tf
 import tensorflow.contrib.seq2seq as seq2seq
+from Latex.LatexBase import get_sequence_data
+from tensorflow.python.grappler import tf_optimizer
+
+# Checkpoint restored by `restore`
+CHECKPOINT_PATH = "backend/download/h2l-repo/seq_mod/model"
+# Tensors needed for decoding with `predict_batch`, kept in frozen graphs
+FROZEN_INPUTS = ["inputs", "step_input", "step_c", "step_h"]
+FROZEN_OUTPUTS = [
+    "last_state_c",
+    "last_state_h",
+    "step_logits",
+    "step_state_c",
+    "step_state_h",
+]
+
+
+def fold_constants(graph_def, outputs):
+    """Run Grappler's constant folding over a frozen GraphDef, so that
+    everything not depending on an input, e.g. reshapes of the weights, is
+    computed once at export rather than on every run"""
+    graph = tf.Graph()
+    with graph.as_default():
+        tf.import_graph_def(graph_def, name="")
+    meta_graph = tf.train.export_meta_graph(graph_def=graph_def, graph=graph)
+    # Grappler keeps the nodes listed as fetches
+    meta_graph.collection_def["train_op"].node_list.value.extend(outputs)
+
+    config = tf.ConfigProto()
+    rewrite_options = config.graph_options.rewrite_options
+    rewrite_options.optimizers.append("constfold")
+    rewrite_options.min_graph_nodes = -1
+    return tf_optimizer.OptimizeGraph(config, meta_graph)
 
 
 class Seq2SeqModel(object):
-    def __init__(self):
+    def __init__(self, inference_only=False, frozen_graph=None):
+        """
+        inference_only: leave out the loss and optimizer, which restoring
+            for prediction does not need
+        frozen_graph: GraphDef written by `freeze`, used instead of building
+            the graph and restoring a checkpoint
+        """
         batch_size = 512
         nodes = 256
         embed_size = 20
@@ -47,10 +85,32 @@ class Seq2SeqModel(object):
             " ",
         ]
 
+        if frozen_graph is not None:
+            self.graph = tf.Graph()
+            with self.graph.as_default():
+                tf.import_graph_def(frozen_graph, name="")
+            tensors = {
+                name: self.graph.get_tensor_by_name(name + ":0")
+                for name in FROZEN_INPUTS + FROZEN_OUTPUTS
+            }
+            self.inputs = tensors["inputs"]
+            self.outputs = self.logits = None
+            self.last_state = tf.contrib.rnn.LSTMStateTuple(
+                tensors["last_state_c"], tensors["last_state_h"]
+            )
+            self.step_input = tensors["step_input"]
+            self.step_c = tensors["step_c"]
+            self.step_h = tensors["step_h"]
+            self.step_state = tf.contrib.rnn.LSTMStateTuple(
+                tensors["step_state_c"], tensors["step_state_h"]
+            )
+            self.step_logits = tensors["step_logits"]
+            return
+        self.graph = tf.get_default_graph()
+
         # Tensor where we will feed the data into graph
         inputs = tf.placeholder(tf.float32, (None, x_seq_length, nxchars), "inputs")
         outputs = tf.placeholder(tf.int32, (None, None), "output")
-        targets = tf.placeholder(tf.int32, (None, None), "targets")
 
         # Embedding layers
         output_embedding = tf.Variable(
@@ -70,23 +130,71 @@ class Seq2SeqModel(object):
             )
         # connect outputs to
         logits = tf.contrib.layers.fully_connected(
-            dec_outputs, num_outputs=len(self.ltokens) + 1, activation_fn=None
+            dec_outputs,
+            num_outputs=len(self.ltokens) + 1,
+            activation_fn=None,
+            scope="fully_connected",
         )
-        with tf.name_scope("optimization"):
-            # Loss function
-            loss = tf.contrib.seq2seq.sequence_loss(
-                logits, targets, tf.ones([batch_size, self.y_seq_length])
-            )
-            # Optimizer
-            optimizer = tf.train.RMSPropOptimizer(1e-3).minimize(loss)
+
+        # Single decoder step on the weights above, carrying the LSTM state
+        # between steps so that the encoder runs once per sequence
+        step_input = tf.placeholder(tf.int32, (None,), "step_input")
+        step_c = tf.placeholder(tf.float32, (None, nodes), "step_c")
+        step_h = tf.placeholder(tf.float32, (None, nodes), "step_h")
+        with tf.variable_scope(decoding_scope, reuse=True):
+            with tf.variable_scope("rnn"):
+                step_outputs, step_state = lstm_dec(
+                    tf.nn.embedding_lookup(output_embedding, step_input),
+                    tf.contrib.rnn.LSTMStateTuple(step_c, step_h),
+                )
+        step_logits = tf.contrib.layers.fully_connected(
+            step_outputs,
+            num_outputs=len(self.ltokens) + 1,
+            activation_fn=None,
+            scope="fully_connected",
+            reuse=True,
+        )
+        if not inference_only:
+            targets = tf.placeholder(tf.int32, (None, None), "targets")
+            with tf.name_scope("optimization"):
+                # Loss function
+                loss = tf.contrib.seq2seq.sequence_loss(
+                    logits, targets, tf.ones([batch_size, self.y_seq_length])
+                )
+                # Optimizer
+                optimizer = tf.train.RMSPropOptimizer(1e-3).minimize(loss)
         self.inputs = inputs
         self.outputs = outputs
         self.logits = logits
+        # Named, to be found again in frozen graphs
+        self.last_state = tf.contrib.rnn.LSTMStateTuple(
+            tf.identity(last_state.c, "last_state_c"),
+            tf.identity(last_state.h, "last_state_h"),
+        )
+        self.step_input = step_input
+        self.step_c = step_c
+        self.step_h = step_h
+        self.step_state = tf.contrib.rnn.LSTMStateTuple(
+            tf.identity(step_state.c, "step_state_c"),
+            tf.identity(step_state.h, "step_state_h"),
+        )
+        self.step_logits = tf.identity(step_logits, "step_logits")
 
     def restore(self, sess):
         saver = tf.train.Saver(None)
-        path = "backend/download/h2l-repo/seq_mod/model"
-        saver.restore(sess, save_path=path)
+        saver.restore(sess, save_path=CHECKPOINT_PATH)
+
+    def freeze(self, sess):
+        """Inference-only GraphDef of the restored model, with the variables
+        folded into constants and everything `predict_batch` does not run
+        stripped"""
+        graph_def = tf.graph_util.convert_variables_to_constants(
+            sess, self.graph.as_graph_def(), FROZEN_OUTPUTS
+        )
+        graph_def = tf.graph_util.remove_training_nodes(
+            graph_def, protected_nodes=FROZEN_INPUTS + FROZEN_OUTPUTS
+        )
+        return fold_constants(graph_def, FROZEN_OUTPUTS)
 
     def batch_data(self, x, y, batch_size):
         shuffle = np.random.permutation(len(x))
@@ -98,6 +206,56 @@ class Seq2SeqModel(object):
             start += batch_size
 
     def predict_single(self, sess, x):
+        return self.predict_batch(sess, [x])[0]
+
+    def predict_batch(self, sess, xs):
+        """Greedy decoding of several sequences at once, one token per step
+
+        Parameters
+        ----------
+        sess : tf.Session
+            Session the model was restored into
+        xs : numpy array [X,26,30]
+            Sequence data of each formula
+
+        Returns
+        -------
+        list of X latex strings
+        """
+        if len(xs) == 0:
+            return []
+        xs = np.asarray(xs, dtype=np.float32)
+
+        pad = len(self.ltokens)
+        state = sess.run(self.last_state, feed_dict={self.inputs: xs})
+        dec_input = np.full(len(xs), pad)
+        finished = np.zeros(len(xs), dtype=bool)
+        predictions = []
+        for i in range(self.y_seq_length):
+            step_logits, state = sess.run(
+                [self.step_logits, self.step_state],
+                feed_dict={
+                    self.step_input: dec_input,
+                    self.step_c: state.c,
+                    self.step_h: state.h,
+                },
+            )
+            dec_input = step_logits.argmax(axis=-1)
+            # A sequence ends at its first padding token, so that the output
+            # of a formula does not depend on the others in the batch
+            finished |= dec_input == pad
+            predictions.append(np.where(finished, pad, dec_input))
+            if finished.all():
+                break
+
+        return [
+            "".join(self.ltokens[c] for c in seq if c < pad)
+            for seq in np.array(predictions).T
+        ]
+
+    def predict_single_rerun(self, sess, x):
+        """Runs the encoder and the whole decoder again for every token. Kept
+        to compare against `predict_batch`"""
         x = np.array([x])
         dec_input = np.zeros((len(x), 1)) + len(self.ltokens)
         for i in range(self.y_seq_length):
@@ -116,24 +274,4 @@ class Seq2SeqModel(object):
         return seq
 
     def get_sequence_data(self, formula, nlabels, bb):
-        height, width = formula.shape
-        last_xmax = 0
-        last_ymin = bb[0]["ymin"]
-        step_c = -1
-        nclasses = (
-            nlabels + 4 + 2 + 1
-        )  # 1 for pad and 4 for relative pos, 2 for abs pos and shift from last and width
-        seq = np.zeros((300, nclasses))
-        for step in bb:
-            step_c += 1
-            seq[step_c][:nlabels] = step["probs"]
-            seq[step_c][-1] = 0  # remove pad
-            seq[step_c][-7] = step["xmin"] / width
-            seq[step_c][-6] = step["ymin"] / height
-            seq[step_c][-5] = (step["xmin"] - last_xmax) / 10
-            last_xmax = step["xmax"]
-            seq[step_c][-4] = (step["xmax"] - step["xmin"]) / 48
-            seq[step_c][-3] = (step["ymin"] - last_ymin) / 10
-            seq[step_c][-2] = (step["ymax"] - step["ymin"]) / 48
-            last_ymin = step["ymin"]
-        return seq
+        return get_sequence_data(formula, nlabels, bb)
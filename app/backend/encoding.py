@@ -0,0 +1,188 @@
+import argparse
+import difflib
+import glob
+import os
+
+import cv2
+import numpy as np
+from google.cloud import vision
+
+# Pages are sent to Vision in grayscale and lossy-compressed, which is a
+# fraction of the size of a full-resolution PNG. Pages with many
+# low-confidence words are sent again losslessly at full resolution. They are
+# not downsampled by default: below 200 DPI, local OCR of the sample pages
+# already loses noticeably more text than to the compression
+VISION_ENCODING = os.environ.get("VISION_ENCODING", "jpeg")
+VISION_QUALITY = int(os.environ.get("VISION_QUALITY", 85))
+VISION_TARGET_DPI = int(os.environ.get("VISION_TARGET_DPI", 200))
+# Pages are rasterized at 200 DPI, see `utils.pagecache`. Images rendered at
+# another DPI, e.g. the headers of `utils.splitter`, pass their own
+VISION_SOURCE_DPI = 200
+# Share of words below `VISION_MIN_CONFIDENCE` above which a page is re-queried
+VISION_MIN_CONFIDENCE = 0.6
+VISION_LOW_CONFIDENCE_SHARE = 0.1
+
+# Extension and quality parameter for `cv2.imencode`
+ENCODINGS = {
+    "png": (".png", None),
+    "jpeg": (".jpg", cv2.IMWRITE_JPEG_QUALITY),
+    "webp": (".webp", cv2.IMWRITE_WEBP_QUALITY),
+}
+
+
+# output: encoded image, factor the image was scaled by
+def encode_image(
+    img,
+    encoding=VISION_ENCODING,
+    quality=VISION_QUALITY,
+    dpi=VISION_TARGET_DPI,
+    grayscale=True,
+    source_dpi=VISION_SOURCE_DPI,
+):
+    # Images at or below the target DPI are sent as they are
+    scale = min(1, dpi / source_dpi)
+    if scale < 1:
+        height, width = img.shape[:2]
+        img = cv2.resize(
+            img,
+            (max(1, round(width * scale)), max(1, round(height * scale))),
+            interpolation=cv2.INTER_AREA,
+        )
+    if grayscale and img.ndim == 3:
+        img = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
+
+    extension, quality_param = ENCODINGS[encoding]
+    _, encoded_image = cv2.imencode(
+        extension, img, [quality_param, quality] if quality_param else []
+    )
+
+    return encoded_image.tobytes(), scale
+
+
+# output: the settings Vision responses depend on, part of their cache key
+def encoding_key(source_dpi=VISION_SOURCE_DPI):
+    return f"{VISION_ENCODING}-q{VISION_QUALITY}-{VISION_TARGET_DPI}dpi-{source_dpi}dpi"
+
+
+def encode_full(img):
+    # Lossless and at full resolution, as sent before this encoding stage
+    return encode_image(img, "png", dpi=VISION_SOURCE_DPI, grayscale=False)
+
+
+def rescale_response(response, scale):
+    # Bring bounding boxes back into pixels of the original image
+    if scale == 1:
+        return response
+
+    pb = vision.AnnotateImageResponse.pb(response)
+    boxes = []
+    for page in pb.full_text_annotation.pages:
+        for block in page.blocks:
+            boxes.append(block.bounding_box)
+            for paragraph in block.paragraphs:
+                boxes.append(paragraph.bounding_box)
+                for word in paragraph.words:
+                    boxes.append(word.bounding_box)
+                    boxes.extend(symbol.bounding_box for symbol in word.symbols)
+    for box in boxes:
+        for vertex in box.vertices:
+            vertex.x = round(vertex.x / scale)
+            vertex.y = round(vertex.y / scale)
+
+    return response
+
+
+def low_confidence(response):
+    confidences = np.array(
+        [
+            word.confidence
+            for page in vision.AnnotateImageResponse.pb(
+                response
+            ).full_text_annotation.pages
+            for block in page.blocks
+            for paragraph in block.paragraphs
+            for word in paragraph.words
+        ]
+    )
+    if not len(confidences):
+        return False
+
+    return (confidences < VISION_MIN_CONFIDENCE).mean() > VISION_LOW_CONFIDENCE_SHARE
+
+
+# Report: python -m backend.encoding [--ocr] [--engine tesseract]
+# [--source-dpi DPI]
+# Sizes of the sample pages in each encoding, compared to a full-resolution
+# PNG. With --ocr, pages are also OCR'd through the configured Vision endpoint
+# and the text compared to that of the full-resolution PNG; --engine tesseract
+# OCRs the decoded pages locally instead, without credentials
+def Main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ocr", action="store_true")
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--engine", choices=["google", "tesseract"], default="google")
+    # DPI the sample pages were rendered at
+    parser.add_argument("--source-dpi", type=int, default=VISION_SOURCE_DPI)
+    args = parser.parse_args()
+
+    settings = [("png", 100, args.source_dpi, False)] + [
+        (encoding, quality, dpi, True)
+        for encoding, quality in [
+            ("png", 100),
+            ("jpeg", 95),
+            ("jpeg", 85),
+            ("jpeg", 70),
+            ("webp", 85),
+            ("webp", 70),
+        ]
+        for dpi in (200, 150, 100)
+    ]
+    paths = sorted(glob.glob("./backend/image/*.jpg"))[: args.pages]
+    images = [cv2.cvtColor(cv2.imread(path), cv2.COLOR_BGR2RGB) for path in paths]
+
+    if args.ocr and args.engine == "google":
+        from backend.ggldecode import annotate_batched, vision_request
+        from backend.layout import layout_from_response
+
+        def ocr_text(content, scale):
+            response = annotate_batched([vision_request(content)])[0]
+            return layout_from_response(rescale_response(response, scale)).text
+
+    elif args.ocr:
+        from backend.engines import get_engine
+
+        def ocr_text(content, scale):
+            img = cv2.imdecode(np.frombuffer(content, np.uint8), cv2.IMREAD_UNCHANGED)
+            return get_engine(args.engine).page_layout(img).text
+
+    baseline_size = None
+    baseline_texts = None
+    print(f"{len(images)} pages, sizes relative to a full-resolution RGB PNG")
+    for encoding, quality, dpi, grayscale in settings:
+        encoded = [
+            encode_image(img, encoding, quality, dpi, grayscale, args.source_dpi)
+            for img in images
+        ]
+        size = np.mean([len(content) for content, _ in encoded])
+        baseline_size = baseline_size or size
+        line = (
+            f"{encoding:>4} q{quality:<3} {dpi:>3} DPI "
+            f"{'gray' if grayscale else ' RGB'}: {size / 1024:8.1f} KB/page "
+            f"({size / baseline_size:6.1%})"
+        )
+
+        if args.ocr:
+            texts = [ocr_text(content, scale) for content, scale in encoded]
+            baseline_texts = baseline_texts or texts
+            similarity = np.mean(
+                [
+                    difflib.SequenceMatcher(None, text, baseline).ratio()
+                    for text, baseline in zip(texts, baseline_texts)
+                ]
+            )
+            line += f", text {similarity:.1%} the same"
+        print(line)
+
+
+if __name__ == "__main__":
+    Main()
@@ -0,0 +1,141 @@
+import os
+import threading
+from collections import OrderedDict
+
+import pytesseract
+from backend.layout import layout_from_words
+from backend.ocrcache import image_key
+
+# Engine used when a request does not ask for one: "google", "tesseract" or
+# "latex". The last two run locally, without network access
+OCR_ENGINE = os.environ.get("OCR_ENGINE", "google")
+# Layouts of recently OCR'd pages, in memory
+LAYOUT_CACHE_SIZE = 64
+# Automatic page segmentation, without orientation detection
+TESSERACT_CONFIG = "--psm 3"
+
+
+class GoogleEngine:
+    """Cloud Vision document text detection, cached on disk in
+    `backend.ocrcache`."""
+
+    name = "google"
+
+    def page_layouts(self, imgs, keys):
+        from backend.ggldecode import page_layouts
+
+        return page_layouts(imgs, keys)
+
+
+class TesseractEngine:
+    """Local Tesseract OCR, for printed or neatly written pages."""
+
+    name = "tesseract"
+
+    def page_layouts(self, imgs, keys):
+        return [self.page_layout(img) for img in imgs]
+
+    def page_layout(self, img):
+        data = pytesseract.image_to_data(
+            img, config=TESSERACT_CONFIG, output_type=pytesseract.Output.DICT
+        )
+        rows = [i for i, text in enumerate(data["text"]) if text.strip()]
+
+        # Tesseract paragraphs can span several lines, each of which is a
+        # paragraph for the layout, like handwritten lines from Vision
+        lines = {}
+        return layout_from_words(
+            [data["text"][i].strip() for i in rows],
+            [
+                (
+                    data["left"][i],
+                    data["top"][i],
+                    data["left"][i] + data["width"][i],
+                    data["top"][i] + data["height"][i],
+                )
+                for i in rows
+            ],
+            [data["block_num"][i] for i in rows],
+            [
+                lines.setdefault(
+                    (data["block_num"][i], data["par_num"][i], data["line_num"][i]),
+                    len(lines),
+                )
+                for i in rows
+            ],
+        )
+
+
+class LatexEngine:
+    """Local handwriting-to-LaTeX model, with one LaTeX string per detected
+    word."""
+
+    name = "latex"
+
+    def page_layouts(self, imgs, keys):
+        return [self.page_layout(img) for img in imgs]
+
+    def page_layout(self, img):
+        # Loads TensorFlow and the model, only once this engine is used
+        from backend import i2ldecode
+
+        crop, lines, corners = i2ldecode.get_words(img)
+        document = i2ldecode.get_latex_code(crop, lines)
+
+        words, boxes, paragraphs = [], [], []
+        for line_idx, (line, line_latex) in enumerate(zip(lines, document)):
+            for box, latex in zip(line, line_latex):
+                corrected = i2ldecode.debug_latex([[latex]])[0]
+                if corrected:
+                    words.append(corrected[0])
+                    boxes.append(box)
+                    paragraphs.append(line_idx)
+
+        # Words are found in the detected page, layouts are in pixels of the
+        # whole image like those of the other engines
+        boxes = i2ldecode.boxes_to_image(boxes, crop, corners)
+        return layout_from_words(words, boxes, [0] * len(words), paragraphs)
+
+
+ENGINES = {
+    engine.name: engine for engine in (GoogleEngine(), TesseractEngine(), LatexEngine())
+}
+
+_layouts = OrderedDict()
+_layouts_lock = threading.Lock()
+
+
+def get_engine(name=None):
+    return ENGINES[name or OCR_ENGINE]
+
+
+# input: list of images in numpy array format, engine name (default
+# `OCR_ENGINE`)
+# output: list of PageLayout, built once per distinct page and shared by all
+# parser modes
+def page_layouts(imgs, engine=None):
+    engine = get_engine(engine)
+    keys = [(engine.name, image_key(img)) for img in imgs]
+    with _layouts_lock:
+        layouts = {key: _layouts[key] for key in keys if key in _layouts}
+    missing = {key: img for key, img in zip(keys, imgs) if key not in layouts}
+
+    if missing:
+        for key, layout in zip(
+            missing,
+            engine.page_layouts(list(missing.values()), [key for _, key in missing]),
+        ):
+            layouts[key] = layout
+
+    with _layouts_lock:
+        for key in keys:
+            _layouts[key] = layouts[key]
+            _layouts.move_to_end(key)
+        while len(_layouts) > LAYOUT_CACHE_SIZE:
+            _layouts.popitem(last=False)
+
+    return [layouts[key] for key in keys]
+
+
+def page_layout(img, engine=None):
+    return page_layouts([img], engine)[0]
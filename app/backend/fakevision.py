@@ -0,0 +1,167 @@
+import argparse
+import glob
+import os
+import random
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import grpc
+from google.cloud import vision
+
+# Local stand-in for the Cloud Vision gRPC API, to measure the client side
+# without network access. Every request sleeps for a fixed round trip plus a
+# per-image processing time, and answers with the same handwritten line.
+# A share of requests can be failed as if over quota
+SERVICE = "google.cloud.vision.v1.ImageAnnotator"
+FAKE_TEXT = "1 + 1 = 2"
+
+
+def fake_response():
+    symbols = [
+        vision.Symbol(
+            text=char,
+            bounding_box=vision.BoundingPoly(
+                vertices=[
+                    vision.Vertex(x=100 + 30 * i, y=100),
+                    vision.Vertex(x=125 + 30 * i, y=100),
+                    vision.Vertex(x=125 + 30 * i, y=140),
+                    vision.Vertex(x=100 + 30 * i, y=140),
+                ]
+            ),
+        )
+        for i, char in enumerate(FAKE_TEXT.replace(" ", ""))
+    ]
+    words = [vision.Word(symbols=[symbol], confidence=0.95) for symbol in symbols]
+    page = vision.Page(
+        blocks=[vision.Block(paragraphs=[vision.Paragraph(words=words)])]
+    )
+
+    return vision.AnnotateImageResponse(
+        full_text_annotation=vision.TextAnnotation(text=FAKE_TEXT, pages=[page])
+    )
+
+
+class FakeImageAnnotator:
+    def __init__(self, rtt=0.05, per_image=0.005, error_rate=0):
+        self.rtt = rtt
+        self.per_image = per_image
+        self.error_rate = error_rate
+        self.requests = 0
+        self.images = 0
+        self.errors = 0
+
+    def batch_annotate_images(self, request, context):
+        self.requests += 1
+        self.images += len(request.requests)
+        time.sleep(self.rtt + self.per_image * len(request.requests))
+
+        if random.random() < self.error_rate:
+            self.errors += 1
+            context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, "Quota exceeded")
+
+        return vision.BatchAnnotateImagesResponse(
+            responses=[fake_response() for _ in request.requests]
+        )
+
+
+def start_server(annotator, port=0):
+    server = grpc.server(
+        ThreadPoolExecutor(max_workers=16),
+        # Batches of several pages are well above the 4 MB gRPC default
+        options=[("grpc.max_receive_message_length", 64 * 1024 * 1024)],
+    )
+    server.add_generic_rpc_handlers(
+        [
+            grpc.method_handlers_generic_handler(
+                SERVICE,
+                {
+                    "BatchAnnotateImages": grpc.unary_unary_rpc_method_handler(
+                        annotator.batch_annotate_images,
+                        request_deserializer=vision.BatchAnnotateImagesRequest.deserialize,
+                        response_serializer=vision.BatchAnnotateImagesResponse.serialize,
+                    )
+                },
+            )
+        ]
+    )
+    port = server.add_insecure_port(f"localhost:{port}")
+    server.start()
+
+    return server, f"localhost:{port}"
+
+
+# Benchmark: python -m backend.fakevision [--pages N] [--rtt MS] [--per-image MS]
+# Serve only: python -m backend.fakevision --serve --port 50051, then start the
+# app with VISION_EMULATOR_HOST=localhost:50051
+def Main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=32)
+    parser.add_argument("--rtt", type=float, default=50)
+    parser.add_argument("--per-image", type=float, default=5)
+    parser.add_argument("--serve", action="store_true")
+    parser.add_argument("--port", type=int, default=0)
+    args = parser.parse_args()
+
+    annotator = FakeImageAnnotator(args.rtt / 1000, args.per_image / 1000)
+    server, host = start_server(annotator, args.port)
+    if args.serve:
+        print(f"Fake Vision API listening on {host}")
+        server.wait_for_termination()
+        return
+
+    os.environ["VISION_EMULATOR_HOST"] = host
+    from backend import ggldecode
+    from backend.ocrcache import OcrCache
+
+    ggldecode.VISION_EMULATOR_HOST = host
+    cache_dir = tempfile.TemporaryDirectory()
+
+    paths = sorted(glob.glob("./backend/image/*.jpg"))
+    images = [cv2.imread(paths[i % len(paths)]) for i in range(args.pages)]
+
+    def client_per_page():
+        # What `CloudVisionTextExtractor` used to do
+        for img in images:
+            client = vision.ImageAnnotatorClient(
+                transport=ggldecode.ImageAnnotatorGrpcTransport(
+                    channel=grpc.insecure_channel(host)
+                )
+            )
+            client.batch_annotate_images(
+                requests=[ggldecode.vision_request(ggldecode.encode_image(img)[0])]
+            )
+
+    def shared_client():
+        for img in images:
+            ggldecode.CloudVisionTextExtractor(img)
+
+    def batched():
+        ggldecode.CloudVisionBatchTextExtractor(images)
+
+    for name, run in [
+        ("client per page", client_per_page),
+        ("shared client", shared_client),
+        ("batched", batched),
+        # Same pages again, answered from the OCR cache
+        ("cached", batched),
+    ]:
+        if name != "cached":
+            ggldecode.ocr_cache = OcrCache(os.path.join(cache_dir.name, f"{name}.db"))
+        requests = annotator.requests
+        start = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - start
+        print(
+            f"{name:>16}: {args.pages} pages in {elapsed:.2f}s "
+            f"({1000 * elapsed / args.pages:.1f} ms/page, "
+            f"{annotator.requests - requests} requests)"
+        )
+
+    server.stop(None)
+    cache_dir.cleanup()
+
+
+if __name__ == "__main__":
+    Main()
@@ -0,0 +1,76 @@
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+from backend.models import FROZEN_PATH, load_latex
+
+
+def load(frozen):
+    from backend.numpymodels import test_formulas
+
+    formulas = [formula for formula, _ in test_formulas(8)]
+    start = time.perf_counter()
+    model = load_latex(frozen=frozen, backend="tensorflow")
+    seconds = time.perf_counter() - start
+    # TensorFlow optimizes a graph on its first run
+    model.predict_batch(formulas)
+    return {
+        "seconds": seconds,
+        "first_seconds": time.perf_counter() - start,
+        # Peak resident memory, in KB on Linux
+        "max_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+# Export: python -m backend.freezemodels
+# Writes inference-only graphs of the LaTeX model to FROZEN_PATH, which
+# `backend.models` then loads instead of the checkpoints. Graphs frozen from
+# other checkpoints, e.g. before retraining, are ignored until exported again
+# Report: python -m backend.freezemodels --compare
+# Cold start of a fresh process loading the model from the checkpoints and
+# from the frozen graphs, including the import of TensorFlow, up to its first
+# equations
+def Main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--compare", action="store_true")
+    parser.add_argument("--load", choices=["checkpoint", "frozen"])
+    args = parser.parse_args()
+
+    if args.load:
+        print(json.dumps(load(args.load == "frozen")))
+        return
+
+    if not args.compare:
+        load_latex(frozen=False, backend="tensorflow").freeze(FROZEN_PATH)
+        print(f"Frozen graphs written to {FROZEN_PATH}")
+        return
+
+    if not os.path.isdir(FROZEN_PATH):
+        parser.error("no frozen graphs, run python -m backend.freezemodels first")
+    for source in ["checkpoint", "frozen"]:
+        runs = [
+            json.loads(
+                subprocess.run(
+                    [sys.executable, "-m", "backend.freezemodels", "--load", source],
+                    check=True,
+                    capture_output=True,
+                    text=True,
+                ).stdout.splitlines()[-1]
+            )
+            for _ in range(3)
+        ]
+        seconds = min(run["seconds"] for run in runs)
+        first_seconds = min(run["first_seconds"] for run in runs)
+        max_rss = min(run["max_rss"] for run in runs)
+        print(
+            f"{source:>10}: {seconds:.2f}s to load, {first_seconds:.2f}s to the "
+            f"first equations, {max_rss / 1024:.0f} MB peak RSS"
+        )
+
+
+if __name__ == "__main__":
+    Main()
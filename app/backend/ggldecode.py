@@ -1,11 +1,26 @@
 import os
+import threading
 
 import cv2
+import grpc
 from tqdm import tqdm
 
 popplerpath = r".\backend\download\poppler-0.68.0\bin"
-os.environ["PATH"] = popplerpath
+os.environ["PATH"] += os.pathsep + popplerpath
+from backend.encoding import (
+    VISION_SOURCE_DPI,
+    encode_full,
+    encode_image,
+    encoding_key,
+    low_confidence,
+    rescale_response,
+)
+from backend.layout import highlight_numbers, layout_from_response
+from backend.ocrcache import image_key, ocr_cache
 from google.cloud import vision
+from google.cloud.vision_v1.services.image_annotator.transports import (
+    ImageAnnotatorGrpcTransport,
+)
 from pdf2image import convert_from_path
 from PIL import Image, ImageDraw, ImageFont
 
@@ -14,81 +29,148 @@ os.environ[
 ] = "./backend/dsa3101-2210-12-math-0c5fbe8196aa.json"
 
 
-digits = ["0", "1", "2", "3", "4", "5", "6", "7", "8", "9"]
+# host:port of a local stand-in for the Vision API, e.g. `backend.fakevision`
+VISION_EMULATOR_HOST = os.environ.get("VISION_EMULATOR_HOST")
+# Most images the API accepts in one `batch_annotate_images` request
+VISION_BATCH_SIZE = 16
+# Keep each request well below the API's request size limit
+VISION_BATCH_MAX_BYTES = 10 * 1024 * 1024
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def get_vision_client():
+    # One client per process, so that the channel and credentials are set up
+    # once. gRPC channels do not survive a fork, hence the PID check
+    global _client, _client_pid
+    with _client_lock:
+        if _client is None or _client_pid != os.getpid():
+            if VISION_EMULATOR_HOST:
+                transport = ImageAnnotatorGrpcTransport(
+                    channel=grpc.insecure_channel(VISION_EMULATOR_HOST)
+                )
+                _client = vision.ImageAnnotatorClient(transport=transport)
+            else:
+                _client = vision.ImageAnnotatorClient()
+            _client_pid = os.getpid()
+
+    return _client
+
+
+def vision_request(content):
+    return vision.AnnotateImageRequest(
+        image=vision.Image(content=content),
+        features=[vision.Feature(type_=vision.Feature.Type.DOCUMENT_TEXT_DETECTION)],
+    )
+
+
+# input: list of images in numpy array format, optionally their `image_key`
+# and the DPI they were rendered at
+# output: list of responses, in the same order. Each distinct page is sent to
+# the API at most once, see `backend.ocrcache`
+def CloudVisionBatchTextExtractor(images, keys=None, source_dpi=VISION_SOURCE_DPI):
+    keys = keys or [image_key(img) for img in images]
+    # Responses to pages sent with other settings have boxes scaled for them
+    settings = f"google:{encoding_key(source_dpi)}"
+    keys = [f"{settings}:{key}" for key in keys]
+    images_by_key = dict(zip(keys, images))
+
+    responses = ocr_cache.get_many(
+        keys,
+        lambda keys: [
+            vision.AnnotateImageResponse.serialize(response)
+            for response in annotate_pages(
+                [images_by_key[key] for key in keys], source_dpi
+            )
+        ],
+    )
+    return [
+        vision.AnnotateImageResponse.deserialize(response) for response in responses
+    ]
+
+
+# Pages are sent compactly encoded first, see `backend.encoding`
+def annotate_pages(images, source_dpi=VISION_SOURCE_DPI):
+    encoded = [encode_image(img, source_dpi=source_dpi) for img in images]
+    responses = [
+        rescale_response(response, scale)
+        for response, (_, scale) in zip(
+            annotate_batched([vision_request(content) for content, _ in encoded]),
+            encoded,
+        )
+    ]
+
+    retry = [i for i, response in enumerate(responses) if low_confidence(response)]
+    if retry:
+        for i, response in zip(
+            retry,
+            annotate_batched(
+                [vision_request(encode_full(images[i])[0]) for i in retry]
+            ),
+        ):
+            responses[i] = response
+
+    return responses
+
+
+def annotate_batched(requests):
+    client = get_vision_client()
+    responses = []
+    batch, size = [], 0
+    for request in requests:
+        request_size = len(request.image.content)
+        if batch and (
+            len(batch) == VISION_BATCH_SIZE
+            or size + request_size > VISION_BATCH_MAX_BYTES
+        ):
+            responses.extend(client.batch_annotate_images(requests=batch).responses)
+            batch, size = [], 0
+        batch.append(request)
+        size += request_size
+
+    if batch:
+        responses.extend(client.batch_annotate_images(requests=batch).responses)
+
+    for response in responses:
+        # Failed pages are not cached
+        if response.error.message:
+            raise RuntimeError(f"Cloud Vision error: {response.error.message}")
+
+    return responses
 
 
 def CloudVisionTextExtractor(handwritings):
-    # convert image from numpy to bytes for submittion to Google Cloud Vision
-    _, encoded_image = cv2.imencode(".png", handwritings)
-    content = encoded_image.tobytes()
-    image = vision.Image(content=content)
-
     # feed handwriting image segment to the Google Cloud Vision API
-    client = vision.ImageAnnotatorClient()
-    response = client.document_text_detection(image=image)
-
-    return response
+    return CloudVisionBatchTextExtractor([handwritings])[0]
 
 
 def getTextFromVisionResponse(response, handwritings):
-    order = []
-    for page in response.full_text_annotation.pages:
-        for i, block in enumerate(page.blocks):
-            for paragraph in block.paragraphs:
-                texts = []
-                pmaxX = 0
-                pmaxY = 0
-                pminX = 1000000
-                pminY = 1000000
-                for word in paragraph.words:
-                    check = False
-                    maxX = 0
-                    maxY = 0
-                    minX = 10000000
-                    minY = 10000000
-                    word_text = "".join([symbol.text for symbol in word.symbols])
-                    for i in word_text:
-                        if i in digits:
-                            check = True
-
-                    for symbol in word.symbols:
-                        for i in symbol.bounding_box.vertices:
-                            pmaxX = max(pmaxX, i.x)
-                            pminX = min(pminX, i.x)
-                            pmaxY = max(pmaxY, i.y)
-                            pminY = min(pminY, i.y)
-                    if check:
-                        for symbol in word.symbols:
-                            for i in symbol.bounding_box.vertices:
-                                maxX = max(maxX, i.x)
-                                minX = min(minX, i.x)
-                                maxY = max(maxY, i.y)
-                                minY = min(minY, i.y)
-                        cv2.rectangle(
-                            handwritings, (minX, minY), (maxX, maxY), (36, 255, 12), 2
-                        )
-                    texts.append(word_text)
-                para = " ".join(texts)
-                order.append((pminY, pminX, para))
-    order.sort()
-
-    ans = order[0][2]
-    curY = order[0][0]
-    for i in range(1, len(order)):
-        if order[i][0] - curY > 10:
-            ans += "\n"
-            ans += order[i][2]
-            curY = order[i][0]
-        else:
-            ans += " "
-            ans += order[i][2]
-    return ans, handwritings
-
-
-def google_api_decode(img):
-    responses = CloudVisionTextExtractor(img)
-    handwrittenText, bbox_img = getTextFromVisionResponse(responses, img)
-    return handwrittenText, bbox_img
+    layout = layout_from_response(response)
+    return layout.text, highlight_numbers(handwritings, layout)
+
+
+# input: list of images in numpy array format, optionally their `image_key`
+# and the DPI they were rendered at
+# output: list of PageLayout
+def page_layouts(imgs, keys=None, source_dpi=VISION_SOURCE_DPI):
+    return [
+        layout_from_response(response)
+        for response in CloudVisionBatchTextExtractor(imgs, keys, source_dpi)
+    ]
+
+
+def google_api_decode(img, source_dpi=VISION_SOURCE_DPI):
+    return google_api_decode_batch([img], source_dpi)[0]
+
+
+# Several pages per request, e.g. every page of a script
+def google_api_decode_batch(imgs, source_dpi=VISION_SOURCE_DPI):
+    return [
+        (layout.text, highlight_numbers(img, layout))
+        for layout, img in zip(page_layouts(imgs, source_dpi=source_dpi), imgs)
+    ]
 
 
 """
@@ -0,0 +1,97 @@
+import argparse
+import glob
+import time
+
+import cv2
+import numpy as np
+
+from backend import i2ldecode
+from backend.models import get_model
+
+
+def timed(name, run, count, unit):
+    start = time.perf_counter()
+    result = run()
+    elapsed = time.perf_counter() - start
+    print(
+        f"{name:>22}: {elapsed:.2f}s ({count / elapsed:.1f} {unit}/s, "
+        f"{1000 * elapsed / count:.1f} ms/{unit[:-1]})"
+    )
+    return result
+
+
+# Report: python -m backend.i2lbench [--pages N]
+# Throughput of the handwriting-to-LaTeX model on the word boxes of the sample
+# pages, as `get_latex_code` used to run it once per word box and as it now
+# runs once per page
+def Main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=3)
+    args = parser.parse_args()
+
+    model = get_model("latex")
+    pages = []
+    for path in sorted(glob.glob("./backend/image/*.jpg"))[: args.pages]:
+        crop, lines, _ = i2ldecode.get_words(cv2.imread(path))
+        formulas = [f for line in i2ldecode.get_formulas(crop, lines) for f in line]
+        pages.append([(f, *model.detect_symbols(f)) for f in formulas])
+    boxes = [box for page in pages for box in page]
+    symbols = sum(len(images) for _, _, images in boxes)
+    print(f"{len(pages)} pages, {len(boxes)} word boxes, {symbols} symbols")
+
+    # Symbol classifier: estimator per word box, persistent session per page
+    per_box = timed(
+        "estimator per box",
+        lambda: [model.classify_with_estimator(images) for _, _, images in boxes],
+        symbols,
+        "symbols",
+    )
+    per_page = timed(
+        "session per page",
+        lambda: [
+            model.classify([image for _, _, images in page for image in images])
+            for page in pages
+        ],
+        symbols,
+        "symbols",
+    )
+    per_box_classes = np.concatenate(per_box).argmax(axis=1)
+    per_page_classes = np.concatenate(per_page).argmax(axis=1)
+    same = per_box_classes == per_page_classes
+    print(f"Same class for {same.mean():.1%} of symbols")
+
+    # Sequence decoder: whole decoder per token, one step per token per page
+    def sequence(formula, positions, probabilities):
+        return model.formula_result(formula, positions, probabilities)["seq_data"]
+
+    probabilities = iter(per_box)
+    seq_data = [
+        [sequence(f, positions, next(probabilities))[:26] for f, positions, _ in page]
+        for page in pages
+    ]
+    rerun = timed(
+        "decoder rerun per box",
+        lambda: [
+            model.seqModel.predict_single_rerun(model.seq_sess, x)
+            for page in seq_data
+            for x in page
+        ],
+        len(boxes),
+        "formulas",
+    )
+    stepped = timed(
+        "decoder steps per page",
+        lambda: [
+            equation
+            for page in seq_data
+            for equation in model.seqModel.predict_batch(model.seq_sess, page)
+        ],
+        len(boxes),
+        "formulas",
+    )
+    same = [a.startswith(b) for a, b in zip(rerun, stepped)]
+    print(f"Same equation up to padding for {np.mean(same):.1%} of word boxes")
+
+
+if __name__ == "__main__":
+    Main()
@@ -8,47 +8,73 @@ import cv2
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
-import tensorflow as tf
+from backend.inferencepool import predict_equations
+from backend.models import BRETA_PATH
 from pdf2image import convert_from_path
 from skimage import io
 
 # load utilities from git repo
-sys.path.append(r"backend\download\breta-repo\src")
+sys.path.append(BRETA_PATH)
 from ocr import page, words
 from ocr.helpers import implt
 
-# load latex model
-sys.path.append(r"backend\download\h2l-repo")
-from Latex.Latex import Latex
-
-mean_train = np.load("backend/download/h2l-repo/train_images_mean.npy")
-std_train = np.load("backend/download/h2l-repo/train_images_std.npy")
-model = Latex("model", mean_train, std_train, plotting=True)
-
 
 # detect page, then words and sort left -> right & up -> down
 # input: image in numpy array
-# output: (1) cropped image in numpy array (2) list of bbox coord
+# output: (1) cropped image in numpy array (2) list of bbox coord in the
+# cropped image (3) corners of the page in the input image
 def get_words(img):
     grey = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-    crop = page.detection(grey)
+    corners = page.page_corners(grey)
+    crop = page.detection(grey, corners=corners)
     boxes = words.detection(crop)
     lines = words.sort_words(boxes)
-    return crop, lines
+    return crop, lines, corners
+
+
+# input: (1) list of (x1, y1, x2, y2) boxes in the cropped page (2) the cropped
+# page (3) corners of the page, as returned by `get_words`
+# output: (n, 4) array of the boxes spanning them in the input image
+def boxes_to_image(boxes, crop, corners):
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    if not len(boxes):
+        return boxes.astype(np.int32)
+
+    # Undo the perspective transform of `page.detection`
+    height, width = crop.shape[:2]
+    transform = cv2.getPerspectiveTransform(
+        np.float32([[0, 0], [0, height], [width, height], [width, 0]]),
+        np.float32(corners),
+    )
+    points = boxes[:, [0, 1, 2, 1, 2, 3, 0, 3]].reshape(-1, 1, 2)
+    points = cv2.perspectiveTransform(points, transform).reshape(-1, 4, 2)
+    return (
+        np.concatenate([points.min(axis=1), points.max(axis=1)], axis=1)
+        .round()
+        .astype(np.int32)
+    )
 
 
 # input: (1) crop = image of page in numpy array (2) lines = list of bbox coord
 # output: list of lists, inner list contain latex code for a line
 def get_latex_code(crop, lines):
-    document = []
-    for line in lines:
-        line_content = []
-        for (x1, y1, x2, y2) in line:
-            formula = cv2.cvtColor(crop[y1:y2, x1:x2], cv2.COLOR_BGR2GRAY)
-            latex = model.predict(formula)
-            line_content.append(latex["equation"])
-        document.append(line_content)
-    return document
+    # Every word box on the page goes to the model in one batch, run by the
+    # inference service unless INFERENCE_REPLICAS is 0
+    formulas = get_formulas(crop, lines)
+    latex = iter(predict_equations([f for line in formulas for f in line]))
+    return [[next(latex) for _ in line] for line in formulas]
+
+
+# input: (1) crop = image of page in numpy array (2) lines = list of bbox coord
+# output: list of lists, inner list contain greyscale images of the word boxes
+def get_formulas(crop, lines):
+    return [
+        [
+            cv2.cvtColor(crop[y1:y2, x1:x2], cv2.COLOR_BGR2GRAY)
+            for (x1, y1, x2, y2) in line
+        ]
+        for line in lines
+    ]
 
 
 # balance string
@@ -131,7 +157,7 @@ def compile_latex(correct_document):
 # input: image in numpy array
 def i2l_decode(image):
     print("conversion start...")
-    crop, lines = get_words(image)
+    crop, lines, _ = get_words(image)
     print("found words...")
     code = get_latex_code(crop, lines)
     print("got latex...")
@@ -169,4 +195,5 @@ def Main(imgpath):
     cv2.imwrite("backend/result/latex-temp.jpg", np.array(output[0]))
 
 
-Main("backend/image/0.jpg")
+if __name__ == "__main__":
+    Main("backend/image/0.jpg")
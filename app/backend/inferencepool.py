@@ -0,0 +1,605 @@
+import argparse
+import itertools
+import multiprocessing
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing import resource_tracker, shared_memory
+from multiprocessing.connection import Client, Listener
+
+import numpy as np
+
+# Processes running the LaTeX model, owned by a single inference service per
+# host which the server processes connect to, so that none of them loads the
+# model itself. The number of replicas is independent of the number of web
+# workers, threads or requests calling `predict_equations`; 0 runs the model
+# in the calling process instead
+INFERENCE_REPLICAS = int(os.environ.get("INFERENCE_REPLICAS", 1))
+# host:port of the inference service. Formula images are handed over in
+# shared memory, so it has to run on the same host as its callers
+INFERENCE_ADDRESS = os.environ.get("INFERENCE_ADDRESS", "localhost:6001")
+INFERENCE_AUTHKEY = os.environ.get("INFERENCE_AUTHKEY", "inference").encode()
+# A replica taking a request waits this long for requests of other callers,
+# up to this many formulas, and runs them all as one batch
+INFERENCE_BATCH_WAIT = float(os.environ.get("INFERENCE_BATCH_WAIT", 0.01))
+INFERENCE_BATCH_SIZE = 256
+# Seconds a caller waits for its equations at most
+INFERENCE_TIMEOUT = 300
+# Seconds a caller waits for a service it started to accept connections
+INFERENCE_START_TIMEOUT = 60
+# Seconds between checks that the replicas, or the process owning the
+# service, are alive
+REPLICA_CHECK_INTERVAL = 1
+
+
+def service_address(address=INFERENCE_ADDRESS):
+    host, port = address.rsplit(":", 1)
+    return host, int(port)
+
+
+# input: list of greyscale formula images
+# output: shared memory block holding all of them, list of (offset, shape)
+def write_crops(formulas):
+    formulas = [np.ascontiguousarray(f, dtype=np.uint8) for f in formulas]
+    shm = shared_memory.SharedMemory(
+        create=True, size=max(1, sum(f.nbytes for f in formulas))
+    )
+    layout, offset = [], 0
+    for f in formulas:
+        np.ndarray(f.shape, np.uint8, buffer=shm.buf, offset=offset)[...] = f
+        layout.append((offset, f.shape))
+        offset += f.nbytes
+    return shm, layout
+
+
+# output: copies of the formula images in a shared memory block, which the
+# caller may free as soon as the equations are back
+def read_crops(name, layout):
+    shm = shared_memory.SharedMemory(name=name)
+    # Attaching registers the block with the resource tracker of this process,
+    # which would unlink it at exit although the caller owns it
+    resource_tracker.unregister(shm._name, "shared_memory")
+    try:
+        return [
+            np.ndarray(shape, np.uint8, buffer=shm.buf, offset=offset).copy()
+            for offset, shape in layout
+        ]
+    finally:
+        shm.close()
+
+
+def _equations(model, formulas):
+    return [result["equation"] for result in model.predict_batch(formulas)]
+
+
+# input: model, formula images of each request by request ID
+# output: equations of each request, or the exception running it raised
+def _run_requests(model, formulas):
+    try:
+        equations = iter(
+            _equations(model, [f for crops in formulas.values() for f in crops])
+        )
+        return {
+            request_id: [next(equations) for _ in crops]
+            for request_id, crops in formulas.items()
+        }
+    except Exception as e:
+        if len(formulas) == 1:
+            return {request_id: e for request_id in formulas}
+
+    # One bad formula fails the whole batch, so each request is run again on
+    # its own and only the one it came from fails
+    results = {}
+    for request_id, crops in formulas.items():
+        try:
+            results[request_id] = _equations(model, crops)
+        except Exception as e:
+            results[request_id] = e
+    return results
+
+
+# Runs in a replica process, until it takes None from `requests`. Replies
+# ("ready", load error or None) once, then ("done", request ID, equations,
+# error, formulas in the batch) for each request
+def _serve(requests, responses):
+    from backend.models import get_model
+
+    try:
+        model, load_error = get_model("latex"), None
+    except Exception as e:
+        # Callers get the error rather than waiting for `INFERENCE_TIMEOUT`
+        model, load_error = None, f"LaTeX model failed to load: {e!r}"
+    responses.put(("ready", load_error))
+
+    # A replica of a service that was killed exits rather than hold the model
+    parent = os.getppid()
+    stopping = False
+    while not stopping:
+        try:
+            batch = [requests.get(timeout=REPLICA_CHECK_INTERVAL)]
+        except queue.Empty:
+            if os.getppid() != parent:
+                return
+            continue
+        if batch[0] is None:
+            return
+        count = len(batch[0][2])
+        deadline = time.monotonic() + INFERENCE_BATCH_WAIT
+        while count < INFERENCE_BATCH_SIZE:
+            try:
+                request = requests.get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if request is None:
+                stopping = True
+                break
+            batch.append(request)
+            count += len(request[2])
+
+        formulas = {}
+        for request_id, name, layout in batch:
+            if load_error:
+                responses.put(("done", request_id, None, load_error, 0))
+                continue
+            try:
+                formulas[request_id] = read_crops(name, layout)
+            except Exception as e:
+                # The caller gave up and freed its crops
+                responses.put(("done", request_id, None, repr(e), 0))
+        if not formulas:
+            continue
+
+        batch_size = sum(len(crops) for crops in formulas.values())
+        for request_id, result in _run_requests(model, formulas).items():
+            if isinstance(result, Exception):
+                responses.put(("done", request_id, None, repr(result), batch_size))
+            else:
+                responses.put(("done", request_id, result, None, batch_size))
+
+
+class InferencePool:
+    """Long-lived processes owning the LaTeX model, run by the inference
+    service for all of its clients. The requests of concurrent callers are
+    batched by the replicas.
+
+    If a replica dies, e.g. killed for running out of memory, the waiting
+    callers get an error and the pool starts over with new replicas: a
+    process killed while reading the request queue leaves it locked."""
+
+    def __init__(self, replicas=INFERENCE_REPLICAS):
+        self.replicas = replicas
+        self.requests = 0
+        # Sum over requests of the formulas in the batch that ran them
+        self.batched_formulas = 0
+        # Errors of the replicas that could not load the model
+        self.load_errors = []
+        self._ids = itertools.count()
+        # Futures of the requests waiting for their equations, by ID
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._ready = threading.Condition(self._lock)
+        self._ready_count = 0
+        self._processes = []
+        self._responses = None
+        self._dispatcher = None
+
+    def _start(self):
+        # Replicas are spawned, TensorFlow sessions do not survive a fork
+        context = multiprocessing.get_context("spawn")
+        self._requests = context.Queue()
+        self._responses = context.Queue()
+        self._ready_count = 0
+        self.load_errors = []
+        self._processes = [
+            context.Process(
+                target=_serve, args=(self._requests, self._responses), daemon=True
+            )
+            for _ in range(self.replicas)
+        ]
+        for process in self._processes:
+            process.start()
+        self._dispatcher = threading.Thread(
+            target=self._dispatch, args=(self._responses,), daemon=True
+        )
+        self._dispatcher.start()
+
+    def _ensure_running(self):
+        # Called with the lock held
+        if not self._processes:
+            self._start()
+            return
+
+        dead = [process for process in self._processes if not process.is_alive()]
+        if dead:
+            error = RuntimeError(
+                f"Inference replica exited with code {dead[0].exitcode}"
+            )
+            for future in self._pending.values():
+                future.set_exception(error)
+            self._pending.clear()
+            for process in self._processes:
+                process.kill()
+                process.join()
+            # The dispatcher of the old queues stops on its next check
+            self._start()
+
+    def _dispatch(self, responses):
+        # Hands the responses of all replicas to the waiting callers, and
+        # replaces the replicas if one of them died
+        while True:
+            try:
+                response = responses.get(timeout=REPLICA_CHECK_INTERVAL)
+            except queue.Empty:
+                with self._lock:
+                    if responses is not self._responses:
+                        return
+                    self._ensure_running()
+                continue
+            if response is None:
+                return
+
+            if response[0] == "ready":
+                with self._lock:
+                    self._ready_count += 1
+                    if response[1]:
+                        self.load_errors.append(response[1])
+                    self._ready.notify_all()
+                continue
+
+            _, request_id, equations, error, batch_size = response
+            with self._lock:
+                future = self._pending.pop(request_id, None)
+                self.requests += 1
+                self.batched_formulas += batch_size
+            if future is None:
+                continue
+            if error is None:
+                future.set_result(equations)
+            else:
+                future.set_exception(RuntimeError(error))
+
+    # Starts the replicas and waits until they have loaded the model
+    # output: list of the errors of replicas that could not load it
+    def warm_up(self, timeout=INFERENCE_TIMEOUT):
+        with self._lock:
+            self._ensure_running()
+            self._ready.wait_for(
+                lambda: self._ready_count >= len(self._processes), timeout
+            )
+            return list(self.load_errors)
+
+    # input: name and layout of a shared memory block from `write_crops`,
+    # which the caller frees once the future is done
+    # output: future of the list of latex equations
+    def submit(self, name, layout):
+        future = Future()
+        if not layout:
+            future.set_result([])
+            return future
+
+        with self._lock:
+            self._ensure_running()
+            request_id = next(self._ids)
+            self._pending[request_id] = future
+            self._requests.put((request_id, name, layout))
+        return future
+
+    def shutdown(self):
+        with self._lock:
+            for _ in self._processes:
+                self._requests.put(None)
+            for process in self._processes:
+                process.join()
+            if self._responses is not None:
+                self._responses.put(None)
+            dispatcher = self._dispatcher
+            self._responses = None
+            self._dispatcher = None
+            self._processes = []
+        if dispatcher is not None:
+            dispatcher.join()
+
+
+# Runs in the inference service, one thread per client. Messages are
+# (kind, request ID, arguments...), replies (request ID, result, error)
+def _serve_client(pool, conn):
+    send_lock = threading.Lock()
+
+    def reply(request_id, future):
+        error = future.exception()
+        try:
+            with send_lock:
+                if error is None:
+                    conn.send((request_id, future.result(), None))
+                else:
+                    conn.send((request_id, None, str(error)))
+        except (OSError, ValueError):
+            # The client is gone
+            pass
+
+    def run(request_id, fn, *args):
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        reply(request_id, future)
+
+    while True:
+        try:
+            kind, request_id, *args = conn.recv()
+        except (EOFError, OSError):
+            conn.close()
+            return
+
+        if kind == "predict":
+            pool.submit(*args).add_done_callback(
+                lambda future, request_id=request_id: reply(request_id, future)
+            )
+        elif kind == "warm_up":
+            threading.Thread(
+                target=run, args=(request_id, pool.warm_up), daemon=True
+            ).start()
+        elif kind == "stats":
+            run(request_id, lambda: (pool.requests, pool.batched_formulas))
+
+
+# Runs the inference service until killed or, with `with_parent`, until the
+# process that started it exits. Returns at once if a service already listens
+# at `address`, so that concurrent starts leave a single one
+def serve(address=INFERENCE_ADDRESS, with_parent=False):
+    try:
+        listener = Listener(service_address(address), authkey=INFERENCE_AUTHKEY)
+    except OSError:
+        print(f"Inference service already running at {address}")
+        return
+
+    pool = InferencePool()
+    # Replicas load the model before the first request
+    threading.Thread(target=pool.warm_up, daemon=True).start()
+
+    def accept():
+        while True:
+            try:
+                conn = listener.accept()
+            except (OSError, EOFError, multiprocessing.AuthenticationError):
+                continue
+            threading.Thread(
+                target=_serve_client, args=(pool, conn), daemon=True
+            ).start()
+
+    print(f"Inference service with {pool.replicas} replicas at {address}")
+    if not with_parent:
+        accept()
+        return
+
+    parent = os.getppid()
+    threading.Thread(target=accept, daemon=True).start()
+    while os.getppid() == parent:
+        time.sleep(REPLICA_CHECK_INTERVAL)
+    pool.shutdown()
+    listener.close()
+
+
+# Starts the inference service in a new process, which exits with this one
+def start_service():
+    subprocess.Popen(
+        [sys.executable, "-m", "backend.inferencepool", "--serve", "--with-parent"]
+    )
+
+
+class InferenceClient:
+    """Connection of a server process to the inference service, shared by
+    its threads. The service is started on first use if none is running, by
+    whichever process gets there first.
+
+    A forked worker opens its own connection: neither the connection nor the
+    lock of the parent are used after a fork."""
+
+    def __init__(self, address=INFERENCE_ADDRESS):
+        self.address = address
+        self._ids = itertools.count()
+        # Connection and future of the requests waiting for a reply, by ID
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._conn = None
+
+    def _connect(self):
+        try:
+            return Client(service_address(self.address), authkey=INFERENCE_AUTHKEY)
+        except ConnectionRefusedError:
+            pass
+        start_service()
+        deadline = time.monotonic() + INFERENCE_START_TIMEOUT
+        while True:
+            try:
+                return Client(service_address(self.address), authkey=INFERENCE_AUTHKEY)
+            except ConnectionRefusedError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError(
+                        f"No inference service at {self.address} after "
+                        f"{INFERENCE_START_TIMEOUT}s"
+                    )
+                time.sleep(0.1)
+
+    def _read(self, conn):
+        # Hands the replies of the service to the waiting callers
+        while True:
+            try:
+                request_id, result, error = conn.recv()
+            except (EOFError, OSError):
+                break
+            with self._lock:
+                _, future = self._pending.pop(request_id, (None, None))
+            if future is None:
+                continue
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(RuntimeError(error))
+
+        # The service exited: its callers fail now, the next request starts
+        # another one
+        with self._lock:
+            if self._conn is conn:
+                self._conn = None
+            pending = [
+                request_id
+                for request_id, (request_conn, _) in self._pending.items()
+                if request_conn is conn
+            ]
+            futures = [self._pending.pop(request_id)[1] for request_id in pending]
+        for future in futures:
+            future.set_exception(
+                RuntimeError(f"Lost the inference service at {self.address}")
+            )
+
+    def _request(self, kind, *args):
+        with self._lock:
+            if self._conn is None:
+                self._conn = self._connect()
+                threading.Thread(
+                    target=self._read, args=(self._conn,), daemon=True
+                ).start()
+            request_id = next(self._ids)
+            future = Future()
+            self._pending[request_id] = (self._conn, future)
+            try:
+                self._conn.send((kind, request_id, *args))
+            except OSError:
+                # The service exited since the last request
+                self._conn = None
+                del self._pending[request_id]
+                raise RuntimeError(f"Lost the inference service at {self.address}")
+        return request_id, future
+
+    def _call(self, kind, *args):
+        request_id, future = self._request(kind, *args)
+        try:
+            return future.result(timeout=INFERENCE_TIMEOUT)
+        finally:
+            with self._lock:
+                self._pending.pop(request_id, None)
+
+    # input: list of greyscale formula images
+    # output: list of latex equations, in the same order
+    def predict(self, formulas):
+        if not formulas:
+            return []
+
+        shm, layout = write_crops(formulas)
+        try:
+            return self._call("predict", shm.name, layout)
+        finally:
+            shm.close()
+            shm.unlink()
+
+    # output: requests run by the replicas, and the sum over requests of the
+    # formulas in the batch that ran them
+    def stats(self):
+        return self._call("stats")
+
+    # Starts the service if none is running and waits until its replicas
+    # have loaded the model, over a connection of its own, so that a server
+    # process warming up before forking its workers keeps no connection or
+    # thread
+    # output: list of the errors of replicas that could not load it
+    def warm_up(self):
+        conn = self._connect()
+        try:
+            conn.send(("warm_up", 0))
+            _, load_errors, error = conn.recv()
+        finally:
+            conn.close()
+        if error:
+            raise RuntimeError(error)
+        return load_errors
+
+
+inference_client = InferenceClient()
+os.register_at_fork(after_in_child=inference_client._after_fork)
+
+
+# input: list of greyscale formula images
+# output: list of latex equations, in the same order
+def predict_equations(formulas):
+    if INFERENCE_REPLICAS > 0:
+        return inference_client.predict(formulas)
+
+    from backend.models import get_model
+
+    return _equations(get_model("latex"), formulas)
+
+
+# Service: python -m backend.inferencepool --serve
+# Runs the inference service in the foreground, e.g. as a service of its own
+# rather than started by the first server process needing it
+# Report: python -m backend.inferencepool [--callers N] [--requests N]
+# Equations per second of concurrent callers sending the formulas of
+# `few_test_eq` to the service, and the mean number of formulas per batch
+def Main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--serve", action="store_true")
+    parser.add_argument("--with-parent", action="store_true")
+    parser.add_argument("--callers", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=4)
+    parser.add_argument("--formulas", type=int, default=4)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(with_parent=args.with_parent)
+        return
+
+    from backend.numpymodels import test_formulas
+
+    formulas = [formula for formula, _ in test_formulas()]
+    if not formulas:
+        print("No formulas found in few_test_eq")
+        return
+
+    # Replicas load the model before timing starts
+    start = time.perf_counter()
+    for error in inference_client.warm_up():
+        print(error)
+    print(f"Replicas ready in {time.perf_counter() - start:.2f}s")
+    requests, batched_formulas = inference_client.stats()
+
+    def caller(i):
+        for j in range(args.requests):
+            first = (i * args.requests + j) * args.formulas
+            inference_client.predict(
+                [
+                    formulas[k % len(formulas)]
+                    for k in range(first, first + args.formulas)
+                ]
+            )
+
+    threads = [threading.Thread(target=caller, args=(i,)) for i in range(args.callers)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    total = args.callers * args.requests * args.formulas
+    after_requests, after_batched = inference_client.stats()
+    print(
+        f"{args.callers} callers, {total} formulas in {elapsed:.2f}s: "
+        f"{total / elapsed:.1f} equations/s, "
+        f"{(after_batched - batched_formulas) / (after_requests - requests):.1f} "
+        "formulas per batch"
+    )
+
+
+if __name__ == "__main__":
+    Main()
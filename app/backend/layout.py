@@ -0,0 +1,140 @@
+from dataclasses import dataclass
+
+import cv2
+import numpy as np
+
+DIGITS = set("0123456789")
+# Paragraphs starting within this many pixels of the start of the current line
+# are placed on the same line
+LINE_GAP = 10
+HIGHLIGHT_COLOUR = (36, 255, 12)
+
+
+@dataclass
+class PageLayout:
+    """Words of an OCR'd page, with one row per word in the arrays. Boxes are
+    (x0, y0, x1, y1) in pixels of the OCR'd image."""
+
+    words: list
+    word_boxes: np.ndarray
+    word_block: np.ndarray
+    word_paragraph: np.ndarray
+    # One row per paragraph, in reading order
+    paragraph_boxes: np.ndarray
+    paragraph_line: np.ndarray
+    paragraph_texts: list
+
+    @property
+    def digit_words(self):
+        return np.array(
+            [bool(DIGITS.intersection(word)) for word in self.words], dtype=bool
+        )
+
+    @property
+    def lines(self):
+        lines = [[] for _ in range(self.paragraph_line.max(initial=-1) + 1)]
+        for line, text in zip(self.paragraph_line, self.paragraph_texts):
+            lines[line].append(text)
+        return [" ".join(line) for line in lines]
+
+    @property
+    def text(self):
+        return "\n".join(self.lines)
+
+
+# input: Cloud Vision AnnotateImageResponse
+# output: PageLayout
+def layout_from_response(response):
+    words, word_boxes, word_block, word_paragraph = [], [], [], []
+    paragraph_idx = 0
+    block_idx = 0
+    for page in response.full_text_annotation.pages:
+        for block in page.blocks:
+            for paragraph in block.paragraphs:
+                for word in paragraph.words:
+                    vertices = np.array(
+                        [
+                            (vertex.x, vertex.y)
+                            for symbol in word.symbols
+                            for vertex in symbol.bounding_box.vertices
+                        ],
+                        dtype=np.int32,
+                    ).reshape(-1, 2)
+                    # Words without symbols have no box, and would stretch
+                    # that of their paragraph to the origin
+                    if not len(vertices):
+                        continue
+                    words.append("".join(symbol.text for symbol in word.symbols))
+                    word_boxes.append((*vertices.min(axis=0), *vertices.max(axis=0)))
+                    word_block.append(block_idx)
+                    word_paragraph.append(paragraph_idx)
+                paragraph_idx += 1
+            block_idx += 1
+
+    return layout_from_words(words, word_boxes, word_block, word_paragraph)
+
+
+# input: word texts, (x0, y0, x1, y1) box, block ID and paragraph ID of each
+# word, as found by any OCR engine
+# output: PageLayout
+def layout_from_words(words, word_boxes, word_block, word_paragraph):
+    word_boxes = np.array(word_boxes, dtype=np.int32).reshape(-1, 4)
+    word_paragraph = np.array(word_paragraph, dtype=np.int32)
+
+    # Paragraph boxes span their words, paragraphs without words are dropped
+    paragraphs = np.unique(word_paragraph)
+    paragraph_boxes = np.array(
+        [
+            (
+                *word_boxes[word_paragraph == p, :2].min(axis=0),
+                *word_boxes[word_paragraph == p, 2:].max(axis=0),
+            )
+            for p in paragraphs
+        ],
+        dtype=np.int32,
+    ).reshape(-1, 4)
+    paragraph_texts = [
+        " ".join(words[i] for i in np.flatnonzero(word_paragraph == p))
+        for p in paragraphs
+    ]
+
+    # Reading order: top to bottom, then left to right
+    order = np.lexsort((paragraph_boxes[:, 0], paragraph_boxes[:, 1]))
+    remap = np.empty(len(paragraphs), dtype=np.int32)
+    remap[order] = np.arange(len(paragraphs))
+    paragraph_boxes = paragraph_boxes[order]
+    paragraph_texts = [paragraph_texts[i] for i in order]
+    word_paragraph = remap[np.searchsorted(paragraphs, word_paragraph)]
+
+    paragraph_line = np.zeros(len(paragraphs), dtype=np.int32)
+    line, line_y = 0, None
+    for i, y in enumerate(paragraph_boxes[:, 1]):
+        if line_y is not None and y - line_y > LINE_GAP:
+            line += 1
+            line_y = y
+        elif line_y is None:
+            line_y = y
+        paragraph_line[i] = line
+
+    return PageLayout(
+        words=list(words),
+        word_boxes=word_boxes,
+        word_block=np.array(word_block, dtype=np.int32),
+        word_paragraph=word_paragraph,
+        paragraph_boxes=paragraph_boxes,
+        paragraph_line=paragraph_line,
+        paragraph_texts=paragraph_texts,
+    )
+
+
+# output: (n, 4) array of boxes of the words containing a number
+def number_boxes(layout):
+    return layout.word_boxes[layout.digit_words]
+
+
+# output: copy of the image with a box around every word containing a number
+def highlight_numbers(img, layout):
+    img = np.array(img)
+    for x0, y0, x1, y1 in number_boxes(layout):
+        cv2.rectangle(img, (int(x0), int(y0)), (int(x1), int(y1)), HIGHLIGHT_COLOUR, 2)
+    return img
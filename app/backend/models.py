@@ -0,0 +1,172 @@
+import argparse
+import os
+import sys
+import threading
+import time
+
+# Models are loaded on first use or by `warm_up`, never at import, so that the
+# app and everything not running a model does without TensorFlow. Names of the
+# models to load at startup, comma-separated, e.g. "latex,segmentation"
+MODEL_WARM_UP = os.environ.get("MODEL_WARM_UP", "")
+H2L_PATH = os.path.join("backend", "download", "h2l-repo")
+BRETA_PATH = os.path.join("backend", "download", "breta-repo", "src")
+# Inference-only graphs of the LaTeX model, written by `backend.freezemodels`
+# and loaded instead of the checkpoints when present
+FROZEN_PATH = os.path.join(H2L_PATH, "frozen")
+# Weights of the LaTeX model as NumPy arrays, written by `backend.numpymodels`
+NUMPY_WEIGHTS_PATH = os.path.join(H2L_PATH, "weights")
+# "numpy" runs the LaTeX model without TensorFlow once its weights have been
+# exported, "tensorflow" always runs it in TensorFlow
+LATEX_BACKEND = os.environ.get("LATEX_BACKEND", "numpy")
+# Storage of the weights of the NumPy LaTeX model: "float32" or "float16", see
+# `python -m backend.numpymodels --precisions`, which also reports "int8"
+LATEX_PRECISION = os.environ.get("LATEX_PRECISION", "float32")
+
+
+class ModelRegistry:
+    """Models by name, each loaded once per process on first `get`.
+
+    Calling `warm_up` in a server process before it forks its workers imports
+    the libraries of the models once for all workers. Only the weights of
+    models registered with `fork_safe=True`, i.e. the NumPy LaTeX model, are
+    then shared copy-on-write. TensorFlow models, i.e. the segmentation models
+    and the LaTeX model on the TensorFlow backend, are not shared: sessions do
+    not survive a fork, and a session copies the weights it is given, so they
+    are dropped in the forked worker and loaded again on first use, weights
+    included. `fork_safe` may also be a function deciding for a loaded
+    model."""
+
+    def __init__(self):
+        self._loaders = {}
+        self._models = {}
+        self._locks = {}
+        # Seconds taken by the last load of each model in this process
+        self.load_times = {}
+
+    def register(self, name, loader, fork_safe=False):
+        if not callable(fork_safe):
+            fork_safe = lambda model, safe=fork_safe: safe
+        self._loaders[name] = (loader, fork_safe)
+        self._locks[name] = threading.Lock()
+
+    def names(self):
+        return list(self._loaders)
+
+    def loaded(self, name):
+        return name in self._models
+
+    def get(self, name):
+        model = self._models.get(name)
+        if model is not None:
+            return model
+
+        # One lock per model, so that concurrent first requests wait on a
+        # single load without blocking the loading of other models
+        with self._locks[name]:
+            if name not in self._models:
+                loader, _ = self._loaders[name]
+                start = time.perf_counter()
+                self._models[name] = loader()
+                self.load_times[name] = time.perf_counter() - start
+
+        return self._models[name]
+
+    # input: model names, all registered models if None
+    def warm_up(self, names=None):
+        for name in self.names() if names is None else names:
+            self.get(name)
+
+    def _after_fork(self):
+        # Locks may have been held by another thread of the parent
+        self._locks = {name: threading.Lock() for name in self._loaders}
+        for name, (_, fork_safe) in self._loaders.items():
+            if name in self._models and not fork_safe(self._models[name]):
+                self._models.pop(name, None)
+                self.load_times.pop(name, None)
+
+
+def add_model_paths():
+    for path in [BRETA_PATH, H2L_PATH]:
+        if path not in sys.path:
+            sys.path.append(path)
+
+
+def load_latex(
+    frozen=True, backend=LATEX_BACKEND, precision=LATEX_PRECISION, unverified=False
+):
+    import numpy as np
+
+    add_model_paths()
+    mean_train = np.load(os.path.join(H2L_PATH, "train_images_mean.npy"))
+    std_train = np.load(os.path.join(H2L_PATH, "train_images_std.npy"))
+
+    if backend == "numpy" and os.path.isdir(NUMPY_WEIGHTS_PATH):
+        from Latex.LatexNumpy import LatexNumpy
+
+        return LatexNumpy(
+            NUMPY_WEIGHTS_PATH,
+            mean_train,
+            std_train,
+            plotting=True,
+            precision=precision,
+            unverified=unverified,
+        )
+
+    from Latex.Latex import Latex
+
+    return Latex(
+        os.path.join(H2L_PATH, "model"),
+        mean_train,
+        std_train,
+        plotting=True,
+        frozen_dir=FROZEN_PATH if frozen and os.path.isdir(FROZEN_PATH) else None,
+    )
+
+
+def load_segmentation():
+    add_model_paths()
+    from ocr.characters import load_models
+
+    return load_models()
+
+
+registry = ModelRegistry()
+# NumPy weights are shared with forked workers, TensorFlow models are loaded
+# again in each
+registry.register("latex", load_latex, lambda model: not hasattr(model, "cnn_sess"))
+registry.register("segmentation", load_segmentation)
+os.register_at_fork(after_in_child=registry._after_fork)
+
+
+def get_model(name):
+    return registry.get(name)
+
+
+def warm_up(names=MODEL_WARM_UP):
+    from backend.inferencepool import INFERENCE_REPLICAS, inference_client
+
+    names = [name for name in names.split(",") if name]
+    # The LaTeX model belongs to the replicas of the inference service, which
+    # this starts unless it is already running
+    if "latex" in names and INFERENCE_REPLICAS > 0:
+        names.remove("latex")
+        for error in inference_client.warm_up():
+            print(error)
+    registry.warm_up(names)
+
+
+# Report: python -m backend.models [NAME ...]
+# Load times of the models, including their imports, of all registered models
+# by default
+def Main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("names", nargs="*")
+    args = parser.parse_args()
+
+    for name in args.names or registry.names():
+        registry.get(name)
+        print(f"{name:>14}: loaded in {registry.load_times[name]:.2f}s")
+
+
+if __name__ == "__main__":
+    Main()
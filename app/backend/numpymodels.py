@@ -0,0 +1,165 @@
+import argparse
+import glob
+import os
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+from backend.models import H2L_PATH, NUMPY_WEIGHTS_PATH, add_model_paths, load_latex
+
+SEQ2SEQ_CHECKPOINT = os.path.join(H2L_PATH, "seq_mod", "model")
+
+
+def export():
+    import tensorflow as tf
+
+    add_model_paths()
+    from Latex.LatexNumpy import export_weights
+
+    export_weights(
+        tf.train.latest_checkpoint(os.path.join(H2L_PATH, "model")),
+        SEQ2SEQ_CHECKPOINT,
+        NUMPY_WEIGHTS_PATH,
+    )
+
+
+# input: number of formulas, all if None
+# output: list of (greyscale formula image, expected latex)
+def test_formulas(limit=None):
+    paths = sorted(glob.glob(os.path.join(H2L_PATH, "few_test_eq", "test", "*", "*")))
+    return [
+        (
+            cv2.imread(path, cv2.IMREAD_GRAYSCALE),
+            os.path.basename(path)[: os.path.basename(path).rfind("_")],
+        )
+        for path in paths[:limit]
+    ]
+
+
+# output: symbol probabilities, equations, seconds classifying, seconds
+# decoding
+def run_model(model, formulas):
+    detected = [model.detect_symbols(formula) for formula in formulas]
+    symbols = [image for _, images in detected for image in images]
+
+    start = time.perf_counter()
+    probabilities = model.classify(symbols)
+    classify_time = time.perf_counter() - start
+
+    splits = np.cumsum([len(positions) for positions, _ in detected])[:-1]
+    seq_data = [
+        model.formula_result(formula, positions, formula_probabilities)["seq_data"][:26]
+        for formula, (positions, _), formula_probabilities in zip(
+            formulas, detected, np.split(probabilities, splits)
+        )
+    ]
+    start = time.perf_counter()
+    equations = model.decode(seq_data)
+    decode_time = time.perf_counter() - start
+
+    return probabilities, equations, classify_time, decode_time
+
+
+# Symbol images and labels of the original training data, if downloaded with
+# download.py in the h2l repo
+TEST_IMAGES = os.path.join(H2L_PATH, "test_images.npy")
+TEST_LABELS = os.path.join(H2L_PATH, "test_labels.npy")
+
+
+def precision_report(formulas, expected):
+    if os.path.exists(TEST_IMAGES):
+        test_images = np.load(TEST_IMAGES)
+        test_labels = np.load(TEST_LABELS)
+    else:
+        print(f"No {TEST_IMAGES}, symbol accuracy is not reported")
+
+    add_model_paths()
+    from Latex.LatexNumpy import PRECISIONS, UNVERIFIED_PRECISIONS
+
+    baseline = None
+    for precision in PRECISIONS + UNVERIFIED_PRECISIONS:
+        model = load_latex(backend="numpy", precision=precision, unverified=True)
+        tracemalloc.start()
+        probabilities, equations, classify_time, decode_time = run_model(
+            model, formulas
+        )
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        baseline = baseline or (probabilities, equations)
+
+        symbols = len(probabilities)
+        same_class = probabilities.argmax(axis=1) == baseline[0].argmax(axis=1)
+        line = (
+            f"{precision:>7}: {model.nbytes / 1024 / 1024:5.1f} MB of weights, "
+            f"{peak / 1024 / 1024:5.1f} MB peak while running, "
+            f"{1000 * classify_time / symbols:.2f} ms/symbol, "
+            f"{1000 * decode_time / len(formulas):.2f} ms/formula decoding, "
+            f"same class as float32 for {same_class.mean():.1%} of symbols, "
+            f"same equation for "
+            f"{np.mean([a == b for a, b in zip(equations, baseline[1])]):.1%}, "
+            f"{np.mean([a == b for a, b in zip(equations, expected)]):.1%} correct"
+        )
+        if os.path.exists(TEST_IMAGES):
+            predicted = model.classify(test_images).argmax(axis=1)
+            line += f", {np.mean(predicted == test_labels):.1%} of test_images"
+        print(line)
+
+
+# Export: python -m backend.numpymodels
+# Saves the weights of the LaTeX model from its checkpoints to
+# NUMPY_WEIGHTS_PATH, after which `backend.models` runs the model without
+# TensorFlow
+# Check: python -m backend.numpymodels --verify [--formulas N]
+# Runs the TensorFlow and the NumPy model on the formulas of few_test_eq, and
+# compares their symbol probabilities and equations
+# Report: python -m backend.numpymodels --precisions [--formulas N]
+# Memory, latency and accuracy of the NumPy model with its weights in float32,
+# float16 and int8
+def Main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--verify", action="store_true")
+    parser.add_argument("--precisions", action="store_true")
+    parser.add_argument("--formulas", type=int)
+    args = parser.parse_args()
+
+    if not (args.verify or args.precisions):
+        export()
+        print(f"Weights written to {NUMPY_WEIGHTS_PATH}")
+        return
+
+    if not os.path.isdir(NUMPY_WEIGHTS_PATH):
+        parser.error("no exported weights, run python -m backend.numpymodels first")
+    formulas, expected = zip(*test_formulas(args.formulas))
+    if args.precisions:
+        precision_report(formulas, expected)
+        return
+    outputs = {
+        backend: run_model(load_latex(frozen=False, backend=backend), formulas)
+        for backend in ["tensorflow", "numpy"]
+    }
+
+    symbols = len(outputs["numpy"][0])
+    print(f"{len(formulas)} formulas, {symbols} symbols")
+    for backend, (_, equations, classify_time, decode_time) in outputs.items():
+        correct = np.mean([a == b for a, b in zip(equations, expected)])
+        print(
+            f"{backend:>10}: {1000 * classify_time / symbols:.2f} ms/symbol, "
+            f"{1000 * decode_time / len(formulas):.2f} ms/formula decoding, "
+            f"{correct:.1%} of equations correct"
+        )
+
+    tf_probabilities, tf_equations = outputs["tensorflow"][:2]
+    np_probabilities, np_equations = outputs["numpy"][:2]
+    same_class = tf_probabilities.argmax(axis=1) == np_probabilities.argmax(axis=1)
+    same_equation = [a == b for a, b in zip(tf_equations, np_equations)]
+    print(
+        f"Largest difference in probabilities: "
+        f"{np.abs(tf_probabilities - np_probabilities).max():.2e}, "
+        f"same class for {same_class.mean():.1%} of symbols, "
+        f"same equation for {np.mean(same_equation):.1%} of formulas"
+    )
+
+
+if __name__ == "__main__":
+    Main()
@@ -0,0 +1,173 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+# Serialized OCR responses, keyed by the SHA-256 of the decoded page pixels,
+# so that re-encoding the same page still hits, and by the engine and encoding
+# settings the page was sent with. Shared by every worker process of a
+# deployment
+OCR_CACHE_PATH = "./backend/ocrcache.sqlite3"
+OCR_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+
+def image_key(img):
+    # Hash of the decoded pixels, so that cached pages are not encoded at all
+    img = np.ascontiguousarray(img)
+    sha256 = hashlib.sha256(str(img.shape).encode())
+    sha256.update(img.data)
+    return sha256.hexdigest()
+
+
+class OcrCache:
+    """Disk-backed cache of OCR responses, evicting the least recently used
+    once the stored responses exceed `max_bytes`."""
+
+    def __init__(self, path=OCR_CACHE_PATH, max_bytes=OCR_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        # Requests that waited on an identical request already in flight
+        self.shared = 0
+        # Keys currently being fetched, so concurrent requests for the same
+        # page wait on a single OCR call
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._db = None
+        self._db_pid = None
+
+    def _connect(self):
+        # SQLite connections must not be carried over a fork
+        if self._db is None or self._db_pid != os.getpid():
+            self._db_pid = os.getpid()
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            # Readers in other processes are not blocked by a writer
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, response BLOB, size INTEGER, last_used REAL)"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS responses_last_used "
+                "ON responses (last_used)"
+            )
+
+        return self._db
+
+    # input: list of keys, function fetching the responses of a list of keys
+    # output: list of responses, in the same order as the keys
+    def get_many(self, keys, fetch):
+        responses = {}
+        owned = []
+        waiting = {}
+        with self._lock:
+            db = self._connect()
+            for key in dict.fromkeys(keys):
+                row = db.execute(
+                    "SELECT response FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row:
+                    self.hits += 1
+                    responses[key] = row[0]
+                    with db:
+                        db.execute(
+                            "UPDATE responses SET last_used = ? WHERE key = ?",
+                            (time.time(), key),
+                        )
+                elif key in self._pending:
+                    self.shared += 1
+                    waiting[key] = self._pending[key]
+                else:
+                    self.misses += 1
+                    self._pending[key] = Future()
+                    owned.append(key)
+
+        if owned:
+            error = None
+            try:
+                fetched = fetch(owned)
+                if len(fetched) != len(owned):
+                    raise RuntimeError(
+                        f"Fetched {len(fetched)} responses for {len(owned)} pages"
+                    )
+                with self._lock:
+                    self._put(zip(owned, fetched))
+                responses.update(zip(owned, fetched))
+            except Exception as e:
+                error = e
+                raise
+            finally:
+                # Every owned key is resolved, or requests waiting on it
+                # would block forever
+                with self._lock:
+                    futures = [self._pending.pop(key) for key in owned]
+                for key, future in zip(owned, futures):
+                    if key in responses:
+                        future.set_result(responses[key])
+                    else:
+                        future.set_exception(
+                            error or RuntimeError("OCR request did not complete")
+                        )
+
+        for key, future in waiting.items():
+            responses[key] = future.result()
+
+        return [responses[key] for key in keys]
+
+    def _put(self, items):
+        db = self._connect()
+        with db:
+            now = time.time()
+            db.executemany(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                [(key, response, len(response), now) for key, response in items],
+            )
+
+            size = db.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()[0]
+            if size <= self.max_bytes:
+                return
+
+            evicted = []
+            for key, entry_size in db.execute(
+                "SELECT key, size FROM responses ORDER BY last_used"
+            ):
+                if size <= self.max_bytes:
+                    break
+                evicted.append((key,))
+                size -= entry_size
+            db.executemany("DELETE FROM responses WHERE key = ?", evicted)
+
+    def stats(self):
+        with self._lock:
+            entries, size = (
+                self._connect()
+                .execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses")
+                .fetchone()
+            )
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "shared": self.shared,
+                "entries": entries,
+                "bytes": size,
+            }
+
+
+ocr_cache = OcrCache()
+
+
+if __name__ == "__main__":
+    # Counters are per process, this only reports what is stored
+    stats = ocr_cache.stats()
+    print(
+        f"{stats['entries']} cached responses, "
+        f"{stats['bytes'] / 1024 / 1024:.1f} MB of {OCR_CACHE_MAX_BYTES / 1024 / 1024:.0f} MB"
+    )
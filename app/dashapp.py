@@ -0,0 +1,59 @@
+import dash
+import dash_bootstrap_components as dbc
+from dash import Dash, dcc, html
+from utils.ingest import ingest
+from utils.tiles import tiles
+
+external_stylesheets = ["https://rsms.me/inter/inter.css", dbc.themes.BOOTSTRAP]
+
+
+app = Dash(
+    __name__,
+    external_stylesheets=external_stylesheets,
+    use_pages=True,
+    suppress_callback_exceptions=True,
+)
+# Page images are served as tiles outside of the Dash callbacks
+app.server.register_blueprint(tiles)
+app.server.register_blueprint(ingest)
+# WSGI application, e.g. for `gunicorn dashapp:server`
+server = app.server
+
+nav = html.Div(
+    [
+        dbc.Nav(
+            [
+                dbc.NavItem(
+                    dbc.NavLink(
+                        f"{page['name']}",
+                        href=page["relative_path"],
+                        active="exact",
+                    )
+                )
+                for page in dash.page_registry.values()
+            ],
+            pills=True,
+            style={"margin": "10px"},
+        )
+    ]
+)
+
+
+app.layout = html.Div(
+    [
+        nav,
+        dash.page_container,
+        # Stores uploaded file names and IDs of the PDFs saved server-side
+        dcc.Store(id="upload-store"),
+        dcc.Store(id="file-index"),
+        dcc.Store(id="page-index"),
+        # Store rubric data per page (assuming that one page = one question)
+        dcc.Store(id="page-rubric-data"),
+        # Store question/score data per page
+        dcc.Store(id="student-num-file-data"),
+        # Set of IDs for files that have been marked as completed
+        dcc.Store(id="completed-data"),
+        dcc.Store(id="rubric-item-edit-final-data"),
+        dcc.Store(id="rubric-scheme-data"),
+    ]
+)
@@ -1,18 +1,30 @@
 import base64
+import io
 import itertools
-import re
 import tempfile
 from datetime import datetime
 from operator import attrgetter, itemgetter
 from typing import Iterable
+from urllib.parse import parse_qs
 
 import dash
 import dash_mantine_components as dmc
-import plotly.express as px
+import plotly.graph_objects as go
 from backend.api import gglapi_parse, num_highlighter
-from dash import ALL, MATCH, Input, Output, State, callback, ctx, dcc, html
+from backend.engines import page_layout
+from dash import (
+    ALL,
+    MATCH,
+    Input,
+    Output,
+    State,
+    callback,
+    clientside_callback,
+    ctx,
+    dcc,
+    html,
+)
 from dash_iconify import DashIconify
-from pdf2image import convert_from_bytes, pdfinfo_from_bytes
 from reportlab.lib.styles import getSampleStyleSheet
 from reportlab.platypus import (
     ListFlowable,
@@ -23,13 +35,19 @@ from reportlab.platypus import (
 )
 from reportlab.platypus.doctemplate import inch
 from reportlab.rl_config import defaultPageSize
+from utils.batchocr import start_batch_ocr
 from utils.classes import RubricItem
+from utils.docstore import load_metadata
 from utils.grading import marks_by_question
+from utils.ingest import ingest_file, load_batch
+from utils.jobs import cancel_job, job_status, submit_job
+from utils.pagecache import DEFAULT_DPI, page_cache
+from utils.prerender import prerender_progress, start_prerender
+from utils.splitter import split_entry
+from utils.tiles import tile_images
 
 dash.register_page(__name__, path="/")
 
-STUDENT_NUM_REGEX = ".*([a-zA-Z][0-9]{7}[a-zA-Z]).*"
-
 GRADING_SUBMIT_MODAL_DEFAULT_CHILDREN = [
     dmc.Space(h=20),
     dmc.Group(
@@ -125,6 +143,24 @@ layout = html.Div(
                         "width": "300px",
                     },
                 ),
+                dmc.Checkbox(
+                    id="split-upload-checkbox",
+                    label="Split whole-class scans by student",
+                    style={"margin-top": "31px"},
+                ),
+                dmc.Checkbox(
+                    id="batch-ocr-checkbox",
+                    label="OCR all pages ahead of time",
+                    style={"margin-top": "31px"},
+                ),
+                html.A(
+                    dmc.Button(
+                        "Bulk import (ZIP / folder)",
+                        variant="outline",
+                        style={"height": "60px", "margin-top": "31px"},
+                    ),
+                    href="/ingest",
+                ),
                 html.Div(
                     [
                         dmc.Button(
@@ -138,6 +174,27 @@ layout = html.Div(
                 ),
             ],
         ),
+        html.Div(
+            [
+                dmc.Text(id="prerender-progress-text", size="sm"),
+                dmc.Progress(id="prerender-progress", value=0, size="lg"),
+            ],
+            id="prerender-progress-section",
+            style={"display": "none", "margin": "0px 16px"},
+        ),
+        dcc.Interval(id="prerender-interval", interval=1000, disabled=True),
+        dcc.Store(id="prerender-job"),
+        dmc.Text(id="batch-ocr-status", size="sm", style={"margin": "0px 16px"}),
+        dcc.Interval(id="batch-ocr-interval", interval=2000, disabled=True),
+        dcc.Store(id="batch-ocr-job"),
+        # Bulk imports redirect here with ?batch=, see `upload_files`
+        dcc.Location(id="import-location"),
+        # Two stages of the page figure, see `render_file`
+        dcc.Store(id="page-figure-preview"),
+        dcc.Store(id="page-figure-full"),
+        # Background parser job for the page on screen, see `parse_page`
+        dcc.Store(id="parse-job"),
+        dcc.Interval(id="parse-interval", interval=500, disabled=True),
         html.Hr(),
         dmc.Grid(
             children=[
@@ -211,6 +268,12 @@ layout = html.Div(
                                             "size": "xl",
                                         },
                                     ),
+                                    dmc.Text(
+                                        id="parse-status",
+                                        size="sm",
+                                        color="dimmed",
+                                        style={"margin-top": "24px"},
+                                    ),
                                 ],
                             ),
                             dmc.LoadingOverlay(
@@ -247,6 +310,12 @@ layout = html.Div(
                                 },
                                 style={"width": "100%", "height": "100%"},
                             ),
+                            # Output of the Google parsers, see `parse_page`
+                            dmc.Paper(
+                                id="parsed-text",
+                                p="md",
+                                style={"margin": "16px 0px"},
+                            ),
                             dmc.Col(
                                 dmc.Group(
                                     children=[
@@ -286,7 +355,7 @@ layout = html.Div(
                                 variant="light",
                                 style={"width": 400},
                             ),
-                            href="/rubric", # href=dash.page_registry["pages.rubric"]["relative_path"]
+                            href="/rubric",  # href=dash.page_registry["pages.rubric"]["relative_path"]
                         ),
                         style={
                             "background-color": "rgb(246, 246 ,246)",
@@ -394,53 +463,173 @@ def rubric_item_component(marks, desc, item_idx, editable=True):
     )
 
 
-def render_page_fig(pages, page_idx, parser):
-    img = convert_from_bytes(
-        # Page indexes in PDF form start from 1
-        pages,
-        first_page=page_idx + 1,
-        last_page=page_idx + 1,
-    )[0]
+def render_id(doc_id, page_idx, parser):
+    return f"{doc_id}-{page_idx}-{parser}"
 
-    if int(parser) == 1:
-        img = gglapi_parse(img, False)
-    elif int(parser) == 2:
-        img = gglapi_parse(img, True)
-    elif int(parser) == 3:
-        img = num_highlighter(img)
 
-    fig = px.imshow(img)
+def tiled_page_fig(doc_id, page_idx, parser=0, x_range=None, y_range=None):
+    # The page itself is not part of the figure -- it only references image
+    # tiles served by `utils.tiles`, in PDF point coordinates
+    width, height = load_metadata(doc_id)["page_sizes"][page_idx]
+
+    fig = go.Figure()
     fig.update_layout(annotate_figure_default_layout())
+    fig.update_layout(
+        images=tile_images(doc_id, page_idx, (width, height), x_range, y_range),
+        meta={
+            "doc_id": doc_id,
+            "page_idx": page_idx,
+            "parser": int(parser),
+            "size": [width, height],
+            "render_id": render_id(doc_id, page_idx, parser),
+        },
+        # Keep the grader's zoom while higher resolution tiles are swapped in
+        uirevision=f"{doc_id}-{page_idx}",
+        margin={"l": 0, "r": 0, "t": 0, "b": 0},
+    )
+    fig.update_xaxes(range=x_range or [0, width], showgrid=False, zeroline=False)
+    fig.update_yaxes(
+        range=y_range or [height, 0],
+        scaleanchor="x",
+        showgrid=False,
+        zeroline=False,
+    )
 
     return fig
 
 
+def zoom_page_fig(fig, relayout_data):
+    # Update the tiles of a `tiled_page_fig` for a new zoom level/visible area
+    meta = fig["layout"].get("meta")
+    # Only tiled figures can be zoomed, any other figure is left as it is
+    if not meta or "doc_id" not in meta or not relayout_data:
+        return dash.no_update
+
+    if relayout_data.get("xaxis.autorange"):
+        x_range = y_range = None
+    elif "xaxis.range[0]" in relayout_data:
+        x_range = [relayout_data["xaxis.range[0]"], relayout_data["xaxis.range[1]"]]
+        y_range = (
+            [relayout_data["yaxis.range[0]"], relayout_data["yaxis.range[1]"]]
+            if "yaxis.range[0]" in relayout_data
+            else None
+        )
+    else:
+        # e.g. shapes being drawn, or the initial autosize
+        return dash.no_update
+
+    fig["layout"]["images"] = tile_images(
+        meta["doc_id"], meta["page_idx"], meta["size"], x_range, y_range
+    )
+    # Nothing to re-parse, the page itself has not changed
+    meta["zoomed"] = True
+
+    return fig
+
+
+def highlight_shapes(boxes):
+    # Boxes are in pixels of the page at `DEFAULT_DPI`, the figure in points
+    scale = 72 / DEFAULT_DPI
+    return [
+        {
+            "type": "rect",
+            "xref": "x",
+            "yref": "y",
+            "x0": x0 * scale,
+            "y0": y0 * scale,
+            "x1": x1 * scale,
+            "y1": y1 * scale,
+            "line": {"color": "rgb(36, 255, 12)", "width": 2},
+            "editable": False,
+        }
+        for x0, y0, x1, y1 in boxes.tolist()
+    ]
+
+
+def render_page_fig(doc_id, page_idx, parser):
+    # Page with number highlights, drawn over the tiles rather than into them
+    fig = tiled_page_fig(doc_id, page_idx, parser)
+    fig.update_layout(
+        shapes=highlight_shapes(num_highlighter(page_cache.get(doc_id, page_idx)))
+    )
+
+    return fig
+
+
+def parsed_text_children(lines):
+    # Lines the solver found to be wrong are shown in red
+    if not lines:
+        return []
+
+    return [dmc.Text("Parsed text", weight=700)] + [
+        dmc.Text(line["text"], color="red" if line["correct"] is False else None)
+        for line in lines
+    ]
+
+
 def get_file_render_info(files, file_idx, page_idx=0, parser=0):
+    # First stage of rendering: a tiled figure of the page that is quick to
+    # build, and which the browser fills in from a low resolution backdrop.
+    # Parser output, if any, is swapped in later by `parse_page`
     file_idx = str(file_idx)
-    name, upload_datetime, contents = itemgetter("name", "date", "contents")(
+    name, upload_datetime, doc_id = itemgetter("name", "date", "doc_id")(
         files[file_idx]
     )
-    decoded = base64.b64decode(contents)
-    fig = render_page_fig(decoded, page_idx, parser)
+    fig = tiled_page_fig(doc_id, page_idx, parser)
+    prefetch_neighbour_pages(files, file_idx, page_idx)
 
     return f"Name: {name}", f"Uploaded on {upload_datetime}", fig
 
 
-def process_pdf_upload(file_contents, names, dates):
-    uploaded = {}
+def prefetch_neighbour_pages(files, file_idx, page_idx):
+    # Rasterize the pages a grader is likely to flip to next in the background
+    doc_id = files[file_idx]["doc_id"]
+    keys = []
+    if page_idx + 1 < files[file_idx]["pages"]:
+        keys.append((doc_id, page_idx + 1, DEFAULT_DPI))
+    if page_idx > 0:
+        keys.append((doc_id, page_idx - 1, DEFAULT_DPI))
+
+    next_file_idx = str(int(file_idx) + 1)
+    if next_file_idx in files:
+        keys.append((files[next_file_idx]["doc_id"], 0, DEFAULT_DPI))
+
+    page_cache.prefetch(keys)
+
+
+def append_uploads(uploaded, entries):
+    # New uploads are appended to the current batch. Only the document ID is
+    # kept in the store -- the PDF itself is saved server-side
+    uploaded = dict(uploaded) if uploaded else {}
+    doc_ids = {file["doc_id"] for file in uploaded.values()}
+    for entry in entries:
+        # Skip re-uploads of an identical PDF
+        if entry["doc_id"] in doc_ids:
+            continue
+        doc_ids.add(entry["doc_id"])
+
+        uploaded[str(len(uploaded))] = entry
+
+    return uploaded
+
+
+def process_pdf_upload(file_contents, names, dates, uploaded=None, split=False):
+    entries = []
     if file_contents and names and dates:
-        for idx, (contents, name, date) in enumerate(zip(file_contents, names, dates)):
-            idx = str(idx)
+        for contents, name, date in zip(file_contents, names, dates):
             _, content_string = contents.split(",")
-
-            uploaded[idx] = {}
-            uploaded[idx]["name"] = name
-            uploaded[idx]["contents"] = content_string
-            uploaded[idx]["date"] = datetime.fromtimestamp(date).strftime(
-                "%Y-%m-%d %H:%I:%S"
+            entry = ingest_file(
+                io.BytesIO(base64.b64decode(content_string)),
+                name,
+                datetime.fromtimestamp(date),
             )
+            if split:
+                # One PDF holding the scripts of a whole class
+                entries.extend(split_entry(entry))
+            else:
+                entries.append(entry)
 
-    return uploaded
+    return append_uploads(uploaded, entries)
 
 
 def add_rubric_item(rubric_data, file_idx, question_num, item_idx, marks, description):
@@ -568,62 +757,277 @@ def enable_parser_select(files, path):
 
 @callback(
     Output("upload-store", "data"),
-    Input("upload-section", "contents"),
+    [
+        Input("upload-section", "contents"),
+        Input("import-location", "search"),
+    ],
     [
         State("upload-section", "filename"),
         State("upload-section", "last_modified"),
+        State("upload-store", "data"),
+        State("split-upload-checkbox", "checked"),
     ],
     prevent_initial_call=True,
 )
-def upload_files(contents, names, dates):
-    if contents and names and dates:
-        return process_pdf_upload(contents, names, dates)
+def upload_files(contents, search, names, dates, files, split):
+    if ctx.triggered_id == "upload-section" and contents and names and dates:
+        uploaded = process_pdf_upload(contents, names, dates, files, split)
+    elif search:
+        # Redirected here after a bulk import, see `utils.ingest`
+        batch_id = parse_qs(search.lstrip("?")).get("batch", [None])[0]
+        entries = load_batch(batch_id) if batch_id else None
+        if not entries:
+            return dash.no_update
+        uploaded = append_uploads(files, entries)
+    else:
+        return dash.no_update
 
-    return dash.no_update
+    if uploaded == files:
+        return dash.no_update
+
+    return uploaded
+
+
+@callback(
+    [
+        Output("prerender-job", "data"),
+        Output("prerender-interval", "disabled"),
+        Output("prerender-progress", "value"),
+        Output("prerender-progress-text", "children"),
+        Output("prerender-progress-section", "style"),
+    ],
+    [
+        Input("upload-store", "data"),
+        Input("prerender-interval", "n_intervals"),
+    ],
+    [
+        State("prerender-job", "data"),
+        State("prerender-progress-section", "style"),
+    ],
+    prevent_initial_call=True,
+)
+def prerender_uploaded_pages(files, _n_intervals, job_id, progress_style):
+    # Rasterize every page of every uploaded script in the background, so that
+    # pages are already on disk by the time a grader opens them
+    if ctx.triggered_id == "upload-store":
+        if not files:
+            return dash.no_update
+
+        job_id = start_prerender(
+            [(file["doc_id"], file["pages"]) for file in files.values()]
+        )
+    elif not job_id:
+        return dash.no_update
+
+    progress = prerender_progress(job_id)
+    if progress is None:
+        return None, True, dash.no_update, dash.no_update, dash.no_update
+
+    done, total = progress
+    finished = done >= total
+
+    return (
+        None if finished else job_id,
+        finished,
+        100 * done / total if total else 100,
+        f"Preparing pages: {done}/{total}",
+        {**progress_style, "display": "none" if finished else "block"},
+    )
+
+
+@callback(
+    [
+        Output("batch-ocr-job", "data"),
+        Output("batch-ocr-interval", "disabled"),
+        Output("batch-ocr-status", "children"),
+    ],
+    [
+        Input("upload-store", "data"),
+        Input("batch-ocr-checkbox", "checked"),
+        Input("batch-ocr-interval", "n_intervals"),
+    ],
+    State("batch-ocr-job", "data"),
+    prevent_initial_call=True,
+)
+def batch_ocr_uploaded_pages(files, enabled, _n_intervals, job_id):
+    # Opt-in: OCR every uploaded page in the background, so that parsers have
+    # their results ready. Pages already in the OCR cache are not sent again
+    if ctx.triggered_id in ("upload-store", "batch-ocr-checkbox"):
+        if job_id:
+            cancel_job(job_id)
+        if not enabled or not files:
+            return None, True, ""
+
+        job_id = start_batch_ocr(
+            [(file["doc_id"], file["pages"]) for file in files.values()]
+        )
+        return job_id, False, "OCR: queued"
+
+    job = job_status(job_id) if job_id else None
+    if job is None or job.status == "cancelled":
+        return None, True, dash.no_update
+    if job.status == "failed":
+        return None, True, f"OCR failed: {job.error}"
+    if job.status == "done":
+        done, failed = job.result
+        return (
+            None,
+            True,
+            f"OCR finished: {done} pages" + (f", {failed} failed" if failed else ""),
+        )
+
+    return job_id, False, job.message
 
 
 @callback(
     [
         Output("annotate-name", "children"),
         Output("annotate-datetime", "children"),
-        Output("annotate-active", "figure"),
-        Output("loading-parser", "children"),
+        Output("page-figure-preview", "data"),
     ],
     [
         Input("upload-store", "data"),
         Input("page-index", "data"),
         Input("file-index", "data"),
         Input("parser-select", "value"),
+        Input("annotate-active", "relayoutData"),
     ],
     [
         State("upload-store", "data"),
         State("parser-select", "value"),
+        State("annotate-active", "figure"),
     ],
     prevent_initial_call=True,
 )
-def render_file(initial, page_idx, file_idx, parser_change, files, parser_current):
-    if ctx.triggered_id == "upload-store" and initial:
-        # File gets uploaded initially -- render first of uploaded files
-        return *get_file_render_info(initial, 0), dash.no_update
+def render_file(
+    initial,
+    page_idx,
+    file_idx,
+    parser_change,
+    relayout_data,
+    files,
+    parser_current,
+    current_fig,
+):
+    if ctx.triggered_id == "annotate-active":
+        # Zoom/pan -- fetch tiles at a resolution matching the visible area
+        return dash.no_update, dash.no_update, zoom_page_fig(current_fig, relayout_data)
+    elif ctx.triggered_id == "upload-store" and initial:
+        # File gets uploaded -- render the current file, or the first of the
+        # uploaded files if none is selected yet
+        return get_file_render_info(initial, file_idx or 0)
     elif ctx.triggered_id == "page-index" and page_idx is not None and files:
         # Page changes
-        return (
-            *get_file_render_info(files, file_idx, page_idx, parser=parser_current),
-            dash.no_update,
-        )
+        return get_file_render_info(files, file_idx, page_idx, parser=parser_current)
     elif ctx.triggered_id == "file-index" and file_idx is not None and files:
         # File changes
-        return (
-            *get_file_render_info(files, file_idx, parser=parser_current),
-            dash.no_update,
-        )
+        return get_file_render_info(files, file_idx, parser=parser_current)
     elif ctx.triggered_id == "parser-select":
+        return get_file_render_info(files, file_idx, page_idx or 0, parser_change)
+
+    return dash.no_update
+
+
+# output: (page figure or None, parsed lines or None)
+def parse_page_job(job, doc_id, page_idx, parser):
+    job.update(0.1, "Loading page")
+    img = page_cache.get(doc_id, page_idx)
+    job.update(0.3, "Reading handwriting")
+    page_layout(img)
+    job.update(0.8, "Rendering")
+
+    # The page is OCR'd once, switching parsers only renders its layout again
+    if int(parser) == 3:
+        return render_page_fig(doc_id, page_idx, parser), None
+    return None, gglapi_parse(img, enable_solver=int(parser) == 2)
+
+
+@callback(
+    [
+        Output("page-figure-full", "data"),
+        Output("parse-job", "data"),
+        Output("parse-interval", "disabled"),
+        Output("parse-status", "children"),
+        Output("parsed-text", "children"),
+    ],
+    [
+        Input("page-figure-preview", "data"),
+        Input("parse-interval", "n_intervals"),
+    ],
+    State("parse-job", "data"),
+    prevent_initial_call=True,
+)
+def parse_page(preview_fig, _n_intervals, job_id):
+    # Second stage of rendering: run the selected parser in the background
+    # while the grader is already looking at the page
+    if ctx.triggered_id == "page-figure-preview":
+        meta = preview_fig["layout"].get("meta") if preview_fig else None
+        if meta and meta.get("zoomed"):
+            # Same page, a running job or the parsed text still applies
+            return (dash.no_update,) * 5
+
+        # The grader moved on, the previous page's result is no longer needed
+        if job_id:
+            cancel_job(job_id)
+        if not meta or not meta.get("parser"):
+            return dash.no_update, None, True, "", []
+
+        job_id = submit_job(
+            parse_page_job, meta["doc_id"], meta["page_idx"], meta["parser"]
+        )
+        return dash.no_update, job_id, False, "Queued", []
+
+    job = job_status(job_id) if job_id else None
+    if job is None or job.status == "cancelled":
+        return dash.no_update, None, True, "", dash.no_update
+    if job.status == "failed":
+        return dash.no_update, None, True, f"Parsing failed: {job.error}", []
+    if job.status == "done":
+        fig, lines = job.result
         return (
-            *get_file_render_info(files, file_idx, page_idx or 0, parser_change),
-            dash.no_update,
+            fig or dash.no_update,
+            None,
+            True,
+            "",
+            parsed_text_children(lines),
         )
 
-    return dash.no_update
+    return (
+        dash.no_update,
+        job_id,
+        False,
+        f"{job.message} ({job.progress:.0%})",
+        dash.no_update,
+    )
+
+
+# Show whichever stage of the page render arrived last, dropping parser output
+# for a page/parser the grader has already moved away from
+clientside_callback(
+    """
+    function(preview, full) {
+        const triggered = dash_clientside.callback_context.triggered.map(
+            (t) => t.prop_id
+        );
+        if (triggered.includes("page-figure-full.data")) {
+            if (
+                full && preview &&
+                full.layout.meta.render_id === preview.layout.meta.render_id
+            ) {
+                return full;
+            }
+            return dash_clientside.no_update;
+        }
+        return preview || dash_clientside.no_update;
+    }
+    """,
+    Output("annotate-active", "figure"),
+    [
+        Input("page-figure-preview", "data"),
+        Input("page-figure-full", "data"),
+    ],
+    prevent_initial_call=True,
+)
 
 
 @callback(
@@ -659,12 +1063,11 @@ def change_page_index(
     if current_file_idx is None:
         return dash.no_update
 
-    # TODO: this is super slow, shouldn't have to decode everytime?
     current_page_idx = int(current_page_idx)
     current_file_idx = str(current_file_idx)
 
-    pages = base64.b64decode(files[current_file_idx]["contents"])
-    max_pages = pdfinfo_from_bytes(pages)["Pages"]
+    # Page count is extracted once at upload time
+    max_pages = files[current_file_idx]["pages"]
 
     # Check if page index will be out of range with this button trigger
     # If so, no updates needed to be performed
@@ -1272,13 +1675,12 @@ def update_student_file_map(student_num, files, student_num_file_map, file_idx):
     # Perform one-time population of student number, if can be extracted from
     # uploaded filenames
     if ctx.triggered_id == "upload-store":
-        data = {}
+        data = dict(student_num_file_map) if student_num_file_map else {}
 
         for file_idx, file in files.items():
-            sn_match = re.search(STUDENT_NUM_REGEX, file["name"])
-            if sn_match:
-                data[file_idx] = {}
-                data[file_idx] = sn_match.group(1).upper()
+            # Extracted from the file name at upload time
+            if file_idx not in data and file["student_num"]:
+                data[file_idx] = file["student_num"]
 
         return data
 
@@ -1348,16 +1750,15 @@ def modify_grading_fields(
             dash.no_update,
         )
     elif ctx.triggered_id == "upload-store":
-        # Process first population of student number for first file
-        for file_idx, file in files.items():
-            sn_match = re.search(STUDENT_NUM_REGEX, file["name"])
-            return (
-                "",
-                sn_match.group(1).upper() if sn_match else dash.no_update,
-                dash.no_update,
-                dash.no_update,
-                dash.no_update,
-            )
+        # Process first population of student number for the file shown
+        file = files[str(file_idx or 0)]
+        return (
+            "",
+            file["student_num"] or dash.no_update,
+            dash.no_update,
+            dash.no_update,
+            dash.no_update,
+        )
     # TODO: add case to populate fields when coming from page change
     elif ctx.triggered_id == "submit-grading-btn" and submit_btn_clicks:
         # "Submit final grading" flow after button click
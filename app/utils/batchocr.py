@@ -0,0 +1,169 @@
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from backend.engines import page_layout
+from google.api_core import exceptions
+from tenacity import (
+    AsyncRetrying,
+    retry_if_exception_type,
+    stop_after_attempt,
+    wait_random_exponential,
+)
+from utils.jobs import submit_job
+from utils.pagecache import load_page, rasterize_page
+
+# OCR of every page of an upload ahead of time with `OCR_ENGINE`, so that
+# parsed pages come straight from the OCR cache by the time a grader asks for
+# them
+OCR_CONCURRENCY = int(os.environ.get("OCR_CONCURRENCY", 4))
+# Requests per second to the Vision API, with bursts of up to the same number
+OCR_RATE = float(os.environ.get("OCR_RATE", 8))
+OCR_ATTEMPTS = 5
+# Errors worth trying again after a while, e.g. exceeded quota
+RETRYABLE_ERRORS = (
+    exceptions.ResourceExhausted,
+    exceptions.ServiceUnavailable,
+    exceptions.DeadlineExceeded,
+    exceptions.InternalServerError,
+)
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def ocr_page(doc_id, page_idx):
+    # Same pixels as `page_cache.get`, so the OCR cache key matches the one
+    # used when the grader opens the page, without filling the page cache.
+    # Runs the engine the parse callbacks use and fills its layout cache
+    img = load_page(doc_id, page_idx)
+    if img is None:
+        img = rasterize_page(doc_id, page_idx)
+    page_layout(img)
+
+
+# input: list of (document ID, number of pages), optional progress callback
+# taking (pages done, failed pages, total pages)
+# output: (pages done, failed pages)
+async def ocr_documents(
+    documents, concurrency=OCR_CONCURRENCY, rate=OCR_RATE, on_progress=None
+):
+    pages = [
+        (doc_id, page_idx)
+        for doc_id, num_pages in documents
+        for page_idx in range(num_pages)
+    ]
+    semaphore = asyncio.Semaphore(concurrency)
+    bucket = TokenBucket(rate)
+    done = failed = 0
+
+    async def ocr_with_limits(doc_id, page_idx):
+        nonlocal done, failed
+        async with semaphore:
+            try:
+                async for attempt in AsyncRetrying(
+                    retry=retry_if_exception_type(RETRYABLE_ERRORS),
+                    wait=wait_random_exponential(multiplier=0.5, max=30),
+                    stop=stop_after_attempt(OCR_ATTEMPTS),
+                    reraise=True,
+                ):
+                    with attempt:
+                        await bucket.acquire()
+                        await asyncio.to_thread(ocr_page, doc_id, page_idx)
+                done += 1
+            except Exception:
+                # The page is OCR'd again when a grader opens it
+                failed += 1
+
+        if on_progress:
+            on_progress(done, failed, len(pages))
+
+    await asyncio.gather(
+        *(ocr_with_limits(doc_id, page_idx) for doc_id, page_idx in pages)
+    )
+
+    return done, failed
+
+
+def batch_ocr_job(job, documents):
+    def on_progress(done, failed, total):
+        # Raises if the job was cancelled, which stops the remaining pages
+        job.update(
+            (done + failed) / total,
+            f"OCR: {done + failed}/{total} pages"
+            + (f", {failed} failed" if failed else ""),
+        )
+
+    return asyncio.run(ocr_documents(documents, on_progress=on_progress))
+
+
+# output: job ID, see `utils.jobs`
+def start_batch_ocr(documents):
+    return submit_job(batch_ocr_job, documents)
+
+
+# Benchmark against the local stand-in of the Vision API:
+# python -m utils.batchocr <pdf> [--concurrency N] [--rate R] [--error-rate P]
+def Main():
+    from backend import ggldecode
+    from backend.fakevision import FakeImageAnnotator, start_server
+    from backend.ocrcache import OcrCache
+    from utils.docstore import index_document, save_document_stream
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("pdf")
+    parser.add_argument("--concurrency", type=int, default=OCR_CONCURRENCY)
+    parser.add_argument("--rate", type=float, default=OCR_RATE)
+    parser.add_argument("--error-rate", type=float, default=0.1)
+    args = parser.parse_args()
+
+    annotator = FakeImageAnnotator(error_rate=args.error_rate)
+    server, host = start_server(annotator)
+    ggldecode.VISION_EMULATOR_HOST = host
+
+    with open(args.pdf, "rb") as f:
+        doc_id = save_document_stream(f)
+    pages = index_document(doc_id)["pages"]
+
+    cache_dir = tempfile.TemporaryDirectory()
+    ggldecode.ocr_cache = OcrCache(os.path.join(cache_dir.name, "ocrcache.sqlite3"))
+    for run in ("cold", "cached"):
+        requests = annotator.requests
+        start = time.perf_counter()
+        done, failed = asyncio.run(
+            ocr_documents([(doc_id, pages)], args.concurrency, args.rate)
+        )
+        elapsed = time.perf_counter() - start
+        print(
+            f"{run:>6}: {done} pages OCR'd, {failed} failed in {elapsed:.2f}s, "
+            f"{annotator.requests - requests} requests "
+            f"({annotator.errors} injected errors so far)"
+        )
+
+    server.stop(None)
+    cache_dir.cleanup()
+
+
+if __name__ == "__main__":
+    Main()
@@ -0,0 +1,114 @@
+import hashlib
+import json
+import os
+import re
+import subprocess
+import tempfile
+
+from pdf2image import pdfinfo_from_path
+
+# Uploaded PDFs are stored once on the server, named by the SHA-256 of their
+# contents. The `upload-store` in the browser only holds these IDs.
+UPLOAD_DIR = "./backend/uploads"
+
+
+def document_path(doc_id):
+    return os.path.join(UPLOAD_DIR, f"{doc_id}.pdf")
+
+
+def metadata_path(doc_id):
+    return os.path.join(UPLOAD_DIR, f"{doc_id}.json")
+
+
+def has_document(doc_id):
+    return os.path.isfile(document_path(doc_id))
+
+
+def save_document(contents):
+    doc_id = hashlib.sha256(contents).hexdigest()
+    if has_document(doc_id):
+        # Identical upload, already stored
+        return doc_id
+
+    _write_atomic(document_path(doc_id), contents)
+
+    return doc_id
+
+
+def save_document_stream(fileobj, chunk_size=1024 * 1024):
+    # Same as `save_document`, without reading the whole file into memory
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    sha256 = hashlib.sha256()
+    fd, tmp_path = tempfile.mkstemp(dir=UPLOAD_DIR, suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        for chunk in iter(lambda: fileobj.read(chunk_size), b""):
+            sha256.update(chunk)
+            f.write(chunk)
+
+    doc_id = sha256.hexdigest()
+    if has_document(doc_id):
+        os.remove(tmp_path)
+    else:
+        os.replace(tmp_path, document_path(doc_id))
+
+    return doc_id
+
+
+def load_document(doc_id):
+    with open(document_path(doc_id), "rb") as f:
+        return f.read()
+
+
+def index_document(doc_id):
+    # Extract PDF metadata once per document, so that callbacks never have to
+    # run pdfinfo on the PDF again
+    if os.path.isfile(metadata_path(doc_id)):
+        return load_metadata(doc_id)
+
+    path = document_path(doc_id)
+    info = pdfinfo_from_path(path)
+    metadata = {
+        "pages": info["Pages"],
+        "page_sizes": _page_sizes(path, info["Pages"]),
+        "info": info,
+    }
+    _write_atomic(metadata_path(doc_id), json.dumps(metadata).encode())
+
+    return metadata
+
+
+def load_metadata(doc_id):
+    with open(metadata_path(doc_id)) as f:
+        return json.load(f)
+
+
+# input: path to PDF, number of pages
+# output: list of [width, height] in points for each page, as displayed
+def _page_sizes(path, pages):
+    output = subprocess.run(
+        ["pdfinfo", "-f", "1", "-l", str(pages), path],
+        capture_output=True,
+        check=True,
+        text=True,
+    ).stdout
+
+    sizes = {}
+    for page, width, height in re.findall(
+        r"Page\s+(\d+) size:\s+([\d.]+) x ([\d.]+)", output
+    ):
+        sizes[page] = [float(width), float(height)]
+    for page, rotation in re.findall(r"Page\s+(\d+) rot:\s+(\d+)", output):
+        if int(rotation) % 180 == 90:
+            sizes[page].reverse()
+
+    return [sizes[str(page)] for page in range(1, pages + 1)]
+
+
+def _write_atomic(path, contents):
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    # Write to a temporary file first and rename, so that concurrent readers
+    # never see a partially written file
+    fd, tmp_path = tempfile.mkstemp(dir=UPLOAD_DIR, suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(contents)
+    os.replace(tmp_path, path)
@@ -0,0 +1,222 @@
+import html
+import json
+import os
+import re
+import subprocess
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from flask import Blueprint, abort, redirect, request
+from pdf2image.exceptions import PDFPageCountError, PDFSyntaxError
+from utils.docstore import UPLOAD_DIR, index_document, save_document_stream
+
+STUDENT_NUM_REGEX = ".*([a-zA-Z][0-9]{7}[a-zA-Z]).*"
+# Same format as the upload date shown for each file
+DATE_FORMAT = "%Y-%m-%d %H:%I:%S"
+# Server-side folders can only be ingested from below this directory
+INGEST_FOLDER_ROOT = "./backend/ingest"
+BATCH_DIR = os.path.join(UPLOAD_DIR, "batches")
+INGEST_WORKERS = os.cpu_count()
+# Raised by `index_document` for files that are not readable PDFs
+UNREADABLE_PDF_ERRORS = (
+    PDFPageCountError,
+    PDFSyntaxError,
+    subprocess.CalledProcessError,
+)
+
+INGEST_FORM = """<!DOCTYPE html>
+<html>
+  <head>
+    <title>Bulk import</title>
+    <link rel="stylesheet" href="https://rsms.me/inter/inter.css">
+    <style>body {{ font-family: Inter, sans-serif; margin: 32px; }}</style>
+  </head>
+  <body>
+    <h2>Bulk import scripts</h2>
+    <form action="/ingest" method="post" enctype="multipart/form-data">
+      <p>
+        <label>ZIP archive of PDFs<br>
+          <input type="file" name="archive" accept=".zip,application/zip">
+        </label>
+      </p>
+      <p>
+        <label>or a folder on the server, relative to {root}<br>
+          <input type="text" name="folder" size="40">
+        </label>
+      </p>
+      <p>
+        <label>
+          <input type="checkbox" name="split" value="1">
+          Split whole-class scans into per-student scripts
+        </label>
+      </p>
+      <button type="submit">Import</button>
+    </form>
+  </body>
+</html>
+"""
+
+SKIPPED_PAGE = """<!DOCTYPE html>
+<html>
+  <head>
+    <title>Bulk import</title>
+    <link rel="stylesheet" href="https://rsms.me/inter/inter.css">
+    <style>body {{ font-family: Inter, sans-serif; margin: 32px; }}</style>
+  </head>
+  <body>
+    <h2>Imported {imported} scripts</h2>
+    <p>These files are not readable PDFs and were skipped:</p>
+    <ul>{skipped}</ul>
+    <a href="{url}">Continue to grading</a>
+  </body>
+</html>
+"""
+
+ingest = Blueprint("ingest", __name__)
+
+
+@ingest.route("/ingest", methods=["GET"])
+def ingest_form():
+    return INGEST_FORM.format(root=INGEST_FOLDER_ROOT)
+
+
+@ingest.route("/ingest", methods=["POST"])
+def ingest_batch():
+    # Bulk ingest from a plain HTML form, so that the browser streams the
+    # archive instead of base64-encoding it like `dcc.Upload`. Werkzeug spools
+    # large uploads to a temporary file on disk
+    archive = request.files.get("archive")
+    folder = request.form.get("folder", "").strip()
+
+    if archive and archive.filename:
+        try:
+            entries, skipped = ingest_zip(archive.stream)
+        except zipfile.BadZipFile:
+            abort(400, "Not a valid ZIP archive")
+    elif folder:
+        entries, skipped = ingest_folder(folder)
+    else:
+        abort(400, "Select a ZIP archive or a server folder to import")
+
+    if request.form.get("split"):
+        # Imported here, the splitter builds on this module
+        from utils.splitter import split_entry
+
+        entries = [script for entry in entries for script in split_entry(entry)]
+
+    # The home page picks the batch up from the URL, see `upload_files`
+    url = f"/?batch={save_batch(entries)}"
+    if skipped:
+        return SKIPPED_PAGE.format(
+            imported=len(entries),
+            skipped="".join(f"<li>{html.escape(name)}</li>" for name in skipped),
+            url=url,
+        )
+    return redirect(url)
+
+
+def extract_student_num(name):
+    sn_match = re.search(STUDENT_NUM_REGEX, name)
+    return sn_match.group(1).upper() if sn_match else None
+
+
+# input: readable binary file object, file name, last modified datetime
+# output: file entry, as kept in `upload-store`
+def ingest_file(fileobj, name, modified):
+    doc_id = save_document_stream(fileobj)
+    metadata = index_document(doc_id)
+
+    return {
+        "name": name,
+        "doc_id": doc_id,
+        "pages": metadata["pages"],
+        "date": modified.strftime(DATE_FORMAT),
+        "student_num": extract_student_num(name),
+    }
+
+
+# input: function ingesting one file, list of its arguments for each file
+# output: file entries, names of the files that are not readable PDFs
+def ingest_all(ingest_one, files):
+    def ingest_or_skip(args):
+        try:
+            return ingest_one(*args)
+        except UNREADABLE_PDF_ERRORS:
+            return None
+
+    with ThreadPoolExecutor(max_workers=INGEST_WORKERS) as executor:
+        entries = list(executor.map(ingest_or_skip, files))
+
+    skipped = [name for (_, name), entry in zip(files, entries) if entry is None]
+    return [entry for entry in entries if entry is not None], skipped
+
+
+def ingest_zip(fileobj):
+    with zipfile.ZipFile(fileobj) as archive:
+        infos = sorted(
+            (
+                info
+                for info in archive.infolist()
+                if not info.is_dir() and _is_pdf(info.filename)
+            ),
+            key=lambda info: info.filename,
+        )
+
+        # Entries are decompressed straight to disk, several at a time.
+        # `ZipFile` allows concurrent reads of different entries
+        def ingest_entry(info, name):
+            with archive.open(info) as f:
+                return ingest_file(f, name, datetime(*info.date_time))
+
+        return ingest_all(
+            ingest_entry,
+            [(info, os.path.basename(info.filename)) for info in infos],
+        )
+
+
+def ingest_folder(path):
+    root = os.path.realpath(INGEST_FOLDER_ROOT)
+    folder = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, folder]) != root:
+        abort(403, f"Folders can only be imported from {INGEST_FOLDER_ROOT}")
+    if not os.path.isdir(folder):
+        abort(404, f"Folder {path} not found")
+
+    paths = sorted(
+        os.path.join(dirpath, filename)
+        for dirpath, _, filenames in os.walk(folder)
+        for filename in filenames
+        if _is_pdf(filename)
+    )
+
+    def ingest_path(path, name):
+        with open(path, "rb") as f:
+            return ingest_file(f, name, datetime.fromtimestamp(os.path.getmtime(path)))
+
+    return ingest_all(ingest_path, [(path, os.path.basename(path)) for path in paths])
+
+
+def save_batch(entries):
+    batch_id = uuid.uuid4().hex
+    os.makedirs(BATCH_DIR, exist_ok=True)
+    with open(os.path.join(BATCH_DIR, f"{batch_id}.json"), "w") as f:
+        json.dump(entries, f)
+
+    return batch_id
+
+
+def load_batch(batch_id):
+    path = os.path.join(BATCH_DIR, f"{batch_id}.json")
+    if not re.fullmatch("[0-9a-f]{32}", batch_id) or not os.path.isfile(path):
+        return None
+
+    with open(path) as f:
+        return json.load(f)
+
+
+def _is_pdf(filename):
+    return filename.lower().endswith(".pdf") and not os.path.basename(
+        filename
+    ).startswith(".")
@@ -0,0 +1,107 @@
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# Background jobs for work too slow to run inside a Dash callback, e.g. OCR.
+# Threads rather than processes, so that jobs share the page and OCR caches
+# of the server process
+JOB_WORKERS = min(8, os.cpu_count() + 4)
+# Finished jobs nobody collected, e.g. after the grader closed the page, are
+# dropped after this many seconds
+JOB_TTL = 10 * 60
+
+_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="job")
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    def __init__(self):
+        self.status = "queued"
+        self.progress = 0
+        self.message = "Queued"
+        self.result = None
+        self.error = None
+        self.finished_at = None
+        self.future = None
+        self._cancelled = threading.Event()
+
+    @property
+    def finished(self):
+        return self.status in ("done", "failed", "cancelled")
+
+    # Called by the job function, which can only be cancelled in between
+    # updates
+    def update(self, progress, message):
+        if self._cancelled.is_set():
+            raise JobCancelled()
+        self.progress = progress
+        self.message = message
+
+    def cancel(self):
+        self._cancelled.set()
+        if self.future.cancel():
+            self._finish("cancelled")
+
+    def _run(self, fn, args):
+        try:
+            self.status = "running"
+            result = fn(self, *args)
+        except JobCancelled:
+            self._finish("cancelled")
+        except Exception as e:
+            self.error = str(e)
+            self._finish("failed")
+        else:
+            self.result = result
+            self._finish("done")
+
+    def _finish(self, status):
+        self.status = status
+        self.progress = 1
+        self.finished_at = time.monotonic()
+
+
+# input: function taking the job as first argument, then `args`
+# output: job ID to poll with `job_status`
+def submit_job(fn, *args):
+    job = Job()
+    job_id = uuid.uuid4().hex
+    with _jobs_lock:
+        _purge_jobs()
+        _jobs[job_id] = job
+        job.future = _executor.submit(job._run, fn, args)
+
+    return job_id
+
+
+def cancel_job(job_id):
+    with _jobs_lock:
+        job = _jobs.pop(job_id, None)
+
+    if job is not None:
+        job.cancel()
+
+
+# output: the job, or None for an unknown job. Finished jobs are forgotten
+# once their status has been read
+def job_status(job_id):
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        if job is not None and job.finished:
+            del _jobs[job_id]
+
+    return job
+
+
+def _purge_jobs():
+    now = time.monotonic()
+    for job_id, job in list(_jobs.items()):
+        if job.finished and now - job.finished_at > JOB_TTL:
+            del _jobs[job_id]
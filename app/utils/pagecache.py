@@ -0,0 +1,165 @@
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+from utils.docstore import document_path
+from utils.rasterizer import get_rasterizer
+
+# Same as poppler's default when no DPI is given
+DEFAULT_DPI = 200
+PAGE_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+# Disk-backed store of pre-rasterized pages, see `utils.prerender`
+PAGE_DIR = "./backend/pages"
+
+
+def rasterize_page(doc_id, page_idx, dpi=DEFAULT_DPI):
+    page = get_rasterizer().render(document_path(doc_id), page_idx, dpi)
+    return _freeze(page)
+
+
+def page_path(doc_id, page_idx, dpi=DEFAULT_DPI):
+    return os.path.join(PAGE_DIR, doc_id, str(dpi), f"{page_idx}.png")
+
+
+def has_page(doc_id, page_idx, dpi=DEFAULT_DPI):
+    return os.path.isfile(page_path(doc_id, page_idx, dpi))
+
+
+def load_page(doc_id, page_idx, dpi=DEFAULT_DPI):
+    path = page_path(doc_id, page_idx, dpi)
+    if not os.path.isfile(path):
+        return None
+
+    with Image.open(path) as img:
+        return _to_page_array(img)
+
+
+def save_page(doc_id, page_idx, dpi, page):
+    path = page_path(doc_id, page_idx, dpi)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write to a temporary file first and rename, so that concurrent readers
+    # never see a partially written page
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        Image.fromarray(page).save(f, format="PNG")
+    os.replace(tmp_path, path)
+
+
+def _to_page_array(img):
+    return _freeze(np.asarray(img.convert("RGB")))
+
+
+def _freeze(page):
+    # Cached pages are shared between callbacks, so make sure nobody draws
+    # on them in place
+    page.setflags(write=False)
+    return page
+
+
+class PageCache:
+    """Size-bounded LRU cache of rasterized pages, keyed by
+    (document ID, page index, DPI)."""
+
+    def __init__(self, max_bytes=PAGE_CACHE_MAX_BYTES, prefetch_workers=2):
+        self.max_bytes = max_bytes
+        self._pages = OrderedDict()
+        self._size = 0
+        # Pages currently being rasterized, so concurrent requests for the
+        # same page wait on a single render
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=prefetch_workers, thread_name_prefix="page-prefetch"
+        )
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._pages
+
+    def get(self, doc_id, page_idx, dpi=DEFAULT_DPI):
+        key = (doc_id, page_idx, dpi)
+        with self._lock:
+            if key in self._pages:
+                self._pages.move_to_end(key)
+                return self._pages[key]
+
+            future = self._pending.get(key)
+            owner = future is None
+            if owner:
+                future = self._pending[key] = Future()
+
+        if not owner:
+            return future.result()
+
+        try:
+            page = self._load(doc_id, page_idx, dpi)
+        except Exception as e:
+            with self._lock:
+                del self._pending[key]
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            del self._pending[key]
+            self._put(key, page)
+        future.set_result(page)
+
+        return page
+
+    def _load(self, doc_id, page_idx, dpi):
+        page = load_page(doc_id, page_idx, dpi)
+        if page is not None:
+            return page
+
+        full_key = (doc_id, page_idx, DEFAULT_DPI)
+        if dpi < DEFAULT_DPI and (
+            full_key in self or has_page(doc_id, page_idx, DEFAULT_DPI)
+        ):
+            # Downscaling the full-resolution page, which is usually already
+            # pre-rasterized, is much cheaper than rendering it again.
+            # Otherwise a low-resolution rasterization is quicker than waiting
+            # for the full one
+            full = self.get(*full_key)
+            height, width = full.shape[:2]
+            img = Image.fromarray(full).resize(
+                (
+                    max(1, round(width * dpi / DEFAULT_DPI)),
+                    max(1, round(height * dpi / DEFAULT_DPI)),
+                ),
+                Image.BILINEAR,
+                reducing_gap=2.0,
+            )
+            return _to_page_array(img)
+
+        return rasterize_page(doc_id, page_idx, dpi)
+
+    def prefetch(self, keys):
+        for key in keys:
+            with self._lock:
+                if key in self._pages or key in self._pending:
+                    continue
+            self._executor.submit(self._prefetch_page, key)
+
+    def _prefetch_page(self, key):
+        try:
+            self.get(*key)
+        except Exception:
+            # Prefetching is best-effort, e.g. the page may not exist
+            pass
+
+    def _put(self, key, page):
+        if page.nbytes > self.max_bytes:
+            return
+
+        self._pages[key] = page
+        self._size += page.nbytes
+        while self._size > self.max_bytes:
+            _, evicted = self._pages.popitem(last=False)
+            self._size -= evicted.nbytes
+
+
+page_cache = PageCache()
@@ -0,0 +1,96 @@
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+from utils.jobs import JOB_TTL
+from utils.pagecache import DEFAULT_DPI, has_page, rasterize_page, save_page
+
+# One worker process per core, each keeping its own rasterizer and open
+# documents. Spawned rather than forked, since the server process has threads
+# and may hold open documents of its own
+_executor = ProcessPoolExecutor(
+    max_workers=os.cpu_count(), mp_context=multiprocessing.get_context("spawn")
+)
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+
+class PrerenderJob:
+    def __init__(self, total):
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.finished_at = time.monotonic() if total == 0 else None
+        self._lock = threading.Lock()
+
+    @property
+    def finished(self):
+        return self.done + self.failed >= self.total
+
+    def page_done(self, ok=True):
+        with self._lock:
+            if ok:
+                self.done += 1
+            else:
+                self.failed += 1
+            if self.finished:
+                self.finished_at = time.monotonic()
+
+
+# input: list of (document ID, number of pages)
+# output: job ID to poll with `prerender_progress`
+def start_prerender(documents, dpi=DEFAULT_DPI):
+    pages = [
+        (doc_id, page_idx)
+        for doc_id, num_pages in documents
+        for page_idx in range(num_pages)
+    ]
+    job = PrerenderJob(len(pages))
+    job_id = uuid.uuid4().hex
+    with _jobs_lock:
+        _purge_jobs()
+        _jobs[job_id] = job
+
+    for doc_id, page_idx in pages:
+        if has_page(doc_id, page_idx, dpi):
+            job.page_done()
+        else:
+            future = _executor.submit(_prerender_page, doc_id, page_idx, dpi)
+            future.add_done_callback(
+                lambda future: job.page_done(ok=future.exception() is None)
+            )
+
+    return job_id
+
+
+# output: (pages done, total pages), or None for an unknown job
+def prerender_progress(job_id):
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+
+    if job is None:
+        return None
+
+    if job.finished:
+        with _jobs_lock:
+            _jobs.pop(job_id, None)
+
+    return job.done + job.failed, job.total
+
+
+# Jobs of documents uploaded but never shown are not polled to the end
+def _purge_jobs():
+    now = time.monotonic()
+    for job_id, job in list(_jobs.items()):
+        if job.finished_at is not None and now - job.finished_at > JOB_TTL:
+            del _jobs[job_id]
+
+
+# Runs in a worker process
+def _prerender_page(doc_id, page_idx, dpi):
+    # Another job may have written this page since this one was queued
+    if not has_page(doc_id, page_idx, dpi):
+        save_page(doc_id, page_idx, dpi, rasterize_page(doc_id, page_idx, dpi))
@@ -0,0 +1,111 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from pdf2image import convert_from_path, pdfinfo_from_path
+
+try:
+    import fitz  # PyMuPDF
+except ImportError:
+    fitz = None
+
+MAX_OPEN_DOCUMENTS = 32
+
+
+class Pdf2ImageRasterizer:
+    """Runs a pdftoppm process per page."""
+
+    name = "pdf2image"
+
+    def render(self, path, page_idx, dpi):
+        img = convert_from_path(
+            path,
+            dpi=dpi,
+            # Page indexes in PDF form start from 1
+            first_page=page_idx + 1,
+            last_page=page_idx + 1,
+        )[0]
+        return np.asarray(img.convert("RGB"))
+
+    def page_count(self, path):
+        return pdfinfo_from_path(path)["Pages"]
+
+
+class MuPdfRasterizer:
+    """Keeps recently used documents open and renders pages in-process,
+    straight into a numpy buffer."""
+
+    name = "mupdf"
+
+    def __init__(self, max_open=MAX_OPEN_DOCUMENTS):
+        self.max_open = max_open
+        self._documents = OrderedDict()
+        # MuPDF is not thread-safe, renders in one process are serialized
+        self._lock = threading.Lock()
+
+    def render(self, path, page_idx, dpi):
+        with self._lock:
+            pix = self._document(path)[page_idx].get_pixmap(
+                dpi=dpi, colorspace=fitz.csRGB, alpha=False
+            )
+            page = np.frombuffer(pix.samples, dtype=np.uint8).reshape(
+                pix.height, pix.width, pix.n
+            )
+            # `pix` owns the buffer
+            return page.copy()
+
+    def page_count(self, path):
+        with self._lock:
+            return self._document(path).page_count
+
+    def _document(self, path):
+        if path in self._documents:
+            self._documents.move_to_end(path)
+            return self._documents[path]
+
+        document = self._documents[path] = fitz.open(path)
+        if len(self._documents) > self.max_open:
+            _, evicted = self._documents.popitem(last=False)
+            evicted.close()
+
+        return document
+
+
+_rasterizer = None
+
+
+def get_rasterizer():
+    # One long-lived rasterizer per process, PyMuPDF if it is installed
+    global _rasterizer
+    if _rasterizer is None:
+        _rasterizer = MuPdfRasterizer() if fitz else Pdf2ImageRasterizer()
+
+    return _rasterizer
+
+
+# Benchmark: python -m utils.rasterizer <pdf> [dpi]
+def Main(path, dpi=200):
+    rasterizers = [Pdf2ImageRasterizer()]
+    if fitz:
+        rasterizers.append(MuPdfRasterizer())
+    else:
+        print("PyMuPDF not installed, only benchmarking pdf2image")
+
+    pages = rasterizers[0].page_count(path)
+    for rasterizer in rasterizers:
+        # Render twice: the first pass includes opening the document
+        for run in ("cold", "warm"):
+            start = time.perf_counter()
+            for page_idx in range(pages):
+                rasterizer.render(path, page_idx, dpi)
+            elapsed = time.perf_counter() - start
+            print(
+                f"{rasterizer.name:>10} {run}: {pages} pages in {elapsed:.2f}s "
+                f"({1000 * elapsed / pages:.1f} ms/page)"
+            )
+
+
+if __name__ == "__main__":
+    Main(sys.argv[1], *map(int, sys.argv[2:3]))
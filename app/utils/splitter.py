@@ -0,0 +1,127 @@
+import os
+import subprocess
+import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import pytesseract
+from utils.docstore import document_path, index_document, save_document
+from utils.ingest import extract_student_num
+from utils.rasterizer import fitz, get_rasterizer
+
+# Only the top of each page is searched for a student number, at a DPI that
+# is plenty for printed or neatly written headers
+HEADER_FRACTION = 0.2
+HEADER_DPI = 100
+DETECTOR_WORKERS = os.cpu_count()
+# "tesseract" runs locally, "google" goes through the Cloud Vision OCR path
+SPLIT_DETECTOR = os.environ.get("SPLIT_DETECTOR", "tesseract")
+
+
+def tesseract_header_text(header):
+    return pytesseract.image_to_string(header)
+
+
+def google_header_text(header):
+    from backend.ggldecode import google_api_decode
+
+    # Headers are rendered below the DPI pages are sent to Vision at
+    text, _ = google_api_decode(header.copy(), source_dpi=HEADER_DPI)
+    return text
+
+
+HEADER_DETECTORS = {
+    "tesseract": tesseract_header_text,
+    "google": google_header_text,
+}
+
+
+def iter_page_headers(path):
+    # Pages are rendered one at a time, the document is never loaded whole
+    rasterizer = get_rasterizer()
+    for page_idx in range(rasterizer.page_count(path)):
+        page = rasterizer.render(path, page_idx, HEADER_DPI)
+        yield page[: int(page.shape[0] * HEADER_FRACTION)]
+
+
+def iter_page_student_nums(path, detector=SPLIT_DETECTOR):
+    # OCR runs on several headers at once, but only a bounded number of pages
+    # is ever held in memory
+    header_text = HEADER_DETECTORS[detector]
+    with ThreadPoolExecutor(max_workers=DETECTOR_WORKERS) as executor:
+        pending = deque()
+        for header in iter_page_headers(path):
+            pending.append(executor.submit(header_text, header))
+            if len(pending) >= 2 * DETECTOR_WORKERS:
+                yield extract_student_num(pending.popleft().result())
+        while pending:
+            yield extract_student_num(pending.popleft().result())
+
+
+# output: generator of (student number, first page index, last page index).
+# A new script starts on every page whose header has a student number
+# different from the current script's, e.g. a cover page
+def iter_script_boundaries(path, detector=SPLIT_DETECTOR):
+    student_num, first_page = None, 0
+    page_idx = -1
+    for page_idx, page_student_num in enumerate(iter_page_student_nums(path, detector)):
+        if page_student_num and page_student_num != student_num:
+            if page_idx > first_page:
+                yield student_num, first_page, page_idx - 1
+            student_num, first_page = page_student_num, page_idx
+
+    if page_idx >= first_page:
+        yield student_num, first_page, page_idx
+
+
+def extract_pages(path, first_page, last_page):
+    if fitz:
+        with fitz.open(path) as src, fitz.open() as out:
+            out.insert_pdf(src, from_page=first_page, to_page=last_page)
+            return out.tobytes(garbage=3, deflate=True)
+
+    # Fall back to poppler's command line tools
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        subprocess.run(
+            [
+                "pdfseparate",
+                "-f",
+                str(first_page + 1),
+                "-l",
+                str(last_page + 1),
+                path,
+                os.path.join(tmp_dir, "%d.pdf"),
+            ],
+            check=True,
+        )
+        out_path = os.path.join(tmp_dir, "out.pdf")
+        subprocess.run(
+            ["pdfunite"]
+            + [
+                os.path.join(tmp_dir, f"{page}.pdf")
+                for page in range(first_page + 1, last_page + 2)
+            ]
+            + [out_path],
+            check=True,
+        )
+        with open(out_path, "rb") as f:
+            return f.read()
+
+
+# input: file entry of a whole-class scan, as returned by `ingest_file`
+# output: generator of file entries, one per student script
+def split_entry(entry, detector=SPLIT_DETECTOR):
+    path = document_path(entry["doc_id"])
+    stem = os.path.splitext(entry["name"])[0]
+
+    for script_idx, (student_num, first_page, last_page) in enumerate(
+        iter_script_boundaries(path, detector)
+    ):
+        doc_id = save_document(extract_pages(path, first_page, last_page))
+        yield {
+            "name": f"{student_num or 'unknown'}_{stem}_{script_idx + 1}.pdf",
+            "doc_id": doc_id,
+            "pages": index_document(doc_id)["pages"],
+            "date": entry["date"],
+            "student_num": student_num,
+        }
@@ -0,0 +1,135 @@
+import io
+import math
+import re
+from functools import lru_cache
+
+import numpy as np
+from flask import Blueprint, Response, abort, request
+from PIL import Image
+from utils.docstore import has_document
+from utils.pagecache import page_cache
+
+TILE_SIZE = 512
+# DPIs of the available zoom levels, lowest first. The lowest level is always
+# shown as a backdrop for the whole page
+ZOOM_DPIS = (50, 100, 200)
+# Approximate on-screen width of the page viewer, used to pick a zoom level
+VIEWPORT_PX = 800
+TILE_FORMATS = {
+    "webp": ("WEBP", "image/webp", {"quality": 80, "method": 4}),
+    "png": ("PNG", "image/png", {}),
+}
+DEFAULT_TILE_FORMAT = "webp"
+
+tiles = Blueprint("tiles", __name__)
+
+
+@tiles.route("/tiles/<doc_id>/<int:page_idx>/<int:dpi>/<int:row>_<int:col>.<fmt>")
+def page_tile(doc_id, page_idx, dpi, row, col, fmt):
+    if (
+        not re.fullmatch("[0-9a-f]{64}", doc_id)
+        or dpi not in ZOOM_DPIS
+        or fmt not in TILE_FORMATS
+        or not has_document(doc_id)
+    ):
+        abort(404)
+
+    # Documents are content-addressed, so a tile never changes for a given URL
+    etag = f"{doc_id[:16]}-{page_idx}-{dpi}-{row}-{col}-{fmt}"
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        try:
+            data = encode_tile(doc_id, page_idx, dpi, row, col, fmt)
+        except (IndexError, ValueError):
+            abort(404)
+        response = Response(data, mimetype=TILE_FORMATS[fmt][1])
+
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = 365 * 24 * 60 * 60
+    response.cache_control.immutable = True
+    return response
+
+
+@lru_cache(maxsize=256)
+def encode_tile(doc_id, page_idx, dpi, row, col, fmt):
+    page = page_cache.get(doc_id, page_idx, dpi)
+    height, width = page.shape[:2]
+    if row * TILE_SIZE >= height or col * TILE_SIZE >= width:
+        raise IndexError("Tile out of range")
+
+    # Edge tiles are padded to full size, so every tile covers the same area
+    # of the page in the figure
+    tile = np.full((TILE_SIZE, TILE_SIZE, 3), 255, dtype=np.uint8)
+    crop = page[
+        row * TILE_SIZE : (row + 1) * TILE_SIZE,
+        col * TILE_SIZE : (col + 1) * TILE_SIZE,
+    ]
+    tile[: crop.shape[0], : crop.shape[1]] = crop
+
+    pil_format, _, options = TILE_FORMATS[fmt]
+    buffer = io.BytesIO()
+    Image.fromarray(tile).save(buffer, format=pil_format, **options)
+    return buffer.getvalue()
+
+
+def tile_url(doc_id, page_idx, dpi, row, col, fmt=DEFAULT_TILE_FORMAT):
+    return f"/tiles/{doc_id}/{page_idx}/{dpi}/{row}_{col}.{fmt}"
+
+
+def zoom_dpi(visible_width):
+    # Lowest zoom level that still has about one image pixel per screen pixel
+    for dpi in ZOOM_DPIS:
+        if visible_width * dpi / 72 >= VIEWPORT_PX:
+            return dpi
+
+    return ZOOM_DPIS[-1]
+
+
+# Figure coordinates are in PDF points (1/72 inch), independent of zoom level
+# input: page size in points, visible x and y ranges in points (whole page if
+# not given)
+# output: list of Plotly layout images
+def tile_images(doc_id, page_idx, page_size, x_range=None, y_range=None):
+    width, height = page_size
+    x0, x1 = sorted(x_range) if x_range else (0, width)
+    y0, y1 = sorted(y_range) if y_range else (0, height)
+
+    images = _level_images(
+        doc_id, page_idx, page_size, ZOOM_DPIS[0], (0, width), (0, height)
+    )
+    dpi = zoom_dpi(x1 - x0)
+    if dpi != ZOOM_DPIS[0]:
+        images += _level_images(doc_id, page_idx, page_size, dpi, (x0, x1), (y0, y1))
+
+    return images
+
+
+def _level_images(doc_id, page_idx, page_size, dpi, x_range, y_range):
+    tile_pts = TILE_SIZE * 72 / dpi
+    cols = math.ceil(page_size[0] * dpi / 72 / TILE_SIZE)
+    rows = math.ceil(page_size[1] * dpi / 72 / TILE_SIZE)
+
+    def tile_span(lo, hi, count):
+        first = max(0, int(lo // tile_pts))
+        last = min(count - 1, int(hi // tile_pts))
+        return range(first, last + 1)
+
+    return [
+        {
+            "source": tile_url(doc_id, page_idx, dpi, row, col),
+            "xref": "x",
+            "yref": "y",
+            "x": col * tile_pts,
+            "y": row * tile_pts,
+            "sizex": tile_pts,
+            "sizey": tile_pts,
+            "xanchor": "left",
+            "yanchor": "top",
+            "sizing": "stretch",
+            "layer": "below",
+        }
+        for row in tile_span(*y_range, rows)
+        for col in tile_span(*x_range, cols)
+    ]